@@ -0,0 +1,84 @@
+from pathlib import Path
+import threading
+from typing import Dict, Tuple
+
+class ContentIndex:
+    """
+    Index of the enclosures held in the destination folder, by enclosure URL and by SHA-256 of the downloaded content
+    """
+
+    def __init__(self, folder: Path, read_only: bool = False):
+        self.folder = folder
+        self.index_path = folder / '.content_index'
+        self.read_only = read_only
+        self.urls: Dict[str, Tuple[str, str]] = {}
+        self.digests: Dict[str, str] = {}
+        self._lines = 0
+        self._index = None
+        self._lock = threading.Lock()
+        if self.index_path.exists():
+            with self.index_path.open(mode='r') as index:
+                for line in index:
+                    if not line.endswith('\n'):
+                        continue
+                    digest, url, path = line.rstrip('\n').split('\t', 2)
+                    self.urls[url] = (digest, path)
+                    self.digests[digest] = path
+                    self._lines += 1
+
+    def find(self, url: str = None, digest: str = None) -> Tuple[str, Path]:
+        """
+        Digest and library file of an enclosure already downloaded, or (None, None) if there is none still in place
+        """
+        with self._lock:
+            if url in self.urls:
+                digest, path = self.urls[url]
+            elif digest in self.digests:
+                path = self.digests[digest]
+            else:
+                return None, None
+        podcast_file = self.folder / path
+        if not podcast_file.is_file():
+            return None, None
+        return digest, podcast_file
+
+    def store(self, digest: str, url: str, podcast_file: Path):
+        if not digest:
+            return
+        path = str(podcast_file.relative_to(self.folder))
+        with self._lock:
+            if self.urls.get(url) == (digest, path) and self.digests.get(digest) == path:
+                return
+            self.urls[url] = (digest, path)
+            self.digests[digest] = path
+            if self.read_only:
+                return
+            if not self._index:
+                self._index = self.index_path.open(mode='a')
+            self._index.write(F"{digest}\t{url}\t{path}\n")
+            self._index.flush()
+            self._lines += 1
+
+    def close(self):
+        with self._lock:
+            if self._index:
+                self._index.close()
+                self._index = None
+        if not self.read_only and self._lines > 2 * len(self.urls):
+            self.save()
+
+    def save(self):
+        """
+        Rewrite the index with only the latest entry for each URL
+        """
+        with self._lock:
+            if self._index:
+                self._index.close()
+                self._index = None
+            temp_file = self.index_path.with_suffix('.tmp')
+            with temp_file.open(mode='w') as index:
+                for url in sorted(self.urls):
+                    digest, path = self.urls[url]
+                    index.write(F"{digest}\t{url}\t{path}\n")
+            temp_file.replace(self.index_path)
+            self._lines = len(self.urls)
@@ -0,0 +1,156 @@
+import hashlib
+import json
+import logging
+import os
+from pathlib import Path
+import tempfile
+import threading
+import traceback
+from typing import Dict, Tuple
+
+from Episode import Image
+from Http import Http
+from util import *
+
+class LazyImage(Image):
+    """
+    Cover image that is only fetched the first time its data is needed
+    """
+
+    def __init__(self, cache: 'CoverCache', url: str):
+        self.cache = cache
+        self.url = url
+        self._lock = threading.Lock()
+        self._resolved = False
+        self._data: bytes = None
+        self._type: str = None
+
+    def _resolve(self):
+        with self._lock:
+            if not self._resolved:
+                self._data, self._type = self.cache.fetch(self.url)
+                self._resolved = True
+
+    @property
+    def data(self) -> bytes:
+        self._resolve()
+        return self._data
+
+    @property
+    def type(self) -> str:
+        self._resolve()
+        return self._type
+
+    def __bool__(self):
+        return self.data is not None
+
+class CoverCache:
+    """
+    Cover images kept on disk by content hash and looked up by URL, revalidated at most once a run
+    """
+
+    def __init__(self, folder: Path = None, read_only: bool = False):
+        self.folder = folder
+        self.read_only = read_only
+        self._lock = threading.Lock()
+        self._images: Dict[str, LazyImage] = {}
+        self._blobs: Dict[str, bytes] = {}
+
+    def image(self, url: str) -> Image:
+        if not url:
+            return None
+        with self._lock:
+            if url not in self._images:
+                self._images[url] = LazyImage(self, url)
+            return self._images[url]
+
+    def expire(self):
+        """
+        Forget the images resolved so far, so each is revalidated the next time it is needed
+        """
+        with self._lock:
+            self._images.clear()
+            self._blobs.clear()
+
+    def fetch(self, url: str) -> Tuple[bytes, str]:
+        entry = self._load(url)
+        headers = {}
+        if entry and self._read_blob(entry['digest']) is not None:
+            if entry.get('etag'):
+                headers['If-None-Match'] = entry['etag']
+            if entry.get('last_modified'):
+                headers['If-Modified-Since'] = entry['last_modified']
+        try:
+            response = Http.request('GET', url, headers=headers)
+            if response.status == 304:
+                return self._read_blob(entry['digest']), entry['type']
+            if response.status >= 400:
+                raise Exception(F"HTTP {response.status}")
+            data: bytes = response.data
+            entry = {
+                'url': url,
+                'digest': hashlib.sha256(data).hexdigest(),
+                'type': response.headers['Content-Type'],
+                'etag': response.headers.get('ETag'),
+                'last_modified': response.headers.get('Last-Modified'),
+            }
+            self._store(entry, data)
+            return self._share(entry['digest'], data), entry['type']
+        except:
+            logging.warning(F"Failed to retrieve cover image {url}")
+            logging.debug(traceback.format_exc())
+            set_error(1)
+        if entry and self._read_blob(entry['digest']) is not None:
+            return self._read_blob(entry['digest']), entry['type']
+        return None, None
+
+    def _share(self, digest: str, data: bytes) -> bytes:
+        with self._lock:
+            return self._blobs.setdefault(digest, data)
+
+    def _entry_path(self, url: str) -> Path:
+        return self.folder / (hashlib.sha1(url.encode('utf-8')).hexdigest() + '.json')
+
+    def _load(self, url: str) -> Dict:
+        if not self.folder:
+            return {}
+        path = self._entry_path(url)
+        if path.exists():
+            try:
+                entry = json.loads(path.read_text())
+                if entry.get('url') == url:
+                    return entry
+            except:
+                logging.debug(traceback.format_exc())
+        return {}
+
+    def _read_blob(self, digest: str) -> bytes:
+        with self._lock:
+            if digest in self._blobs:
+                return self._blobs[digest]
+        if not self.folder:
+            return None
+        blob = self.folder / digest
+        if not blob.exists():
+            return None
+        return self._share(digest, blob.read_bytes())
+
+    def _store(self, entry: Dict, data: bytes):
+        if not self.folder or self.read_only:
+            return
+        self.folder.mkdir(parents=True, exist_ok=True)
+        blob = self.folder / entry['digest']
+        if not blob.exists():
+            self._replace(blob, data)
+        self._replace(self._entry_path(entry['url']), json.dumps(entry, separators=(',', ':')).encode('utf-8'))
+
+    def _replace(self, path: Path, data: bytes):
+        # covers with the same bytes, or the same URL, can be stored by two threads at once
+        descriptor, temp_file = tempfile.mkstemp(dir=self.folder, suffix='.tmp')
+        try:
+            with os.fdopen(descriptor, 'wb') as output:
+                output.write(data)
+            os.replace(temp_file, path)
+        except:
+            os.unlink(temp_file)
+            raise
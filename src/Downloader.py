@@ -0,0 +1,112 @@
+from collections import defaultdict
+from concurrent.futures import Future, ThreadPoolExecutor
+import functools
+import logging
+from pathlib import Path
+import shutil
+import threading
+from typing import Callable, Dict, List, Tuple
+from urllib.parse import urlsplit
+
+from Episode import Episode
+
+class Downloader:
+    """
+    Runs episode downloads, or size checks, on a bounded pool, never starting more than per_host at once against a single host
+    """
+
+    def __init__(self, workers: int = 4, per_host: int = 2, content: 'ContentIndex' = None, memory_folder: Path = None, memory_limit: int = 0):
+        self.workers = max(1, workers)
+        self.per_host = max(1, per_host)
+        self.content = content
+        self.memory_folder = memory_folder
+        self.memory_limit = memory_limit
+        self._pool = ThreadPoolExecutor(max_workers=self.workers)
+        self._lock = threading.Lock()
+        self._pending: List[Tuple[str, Episode, Callable, Future]] = []
+        self._active = defaultdict(int)
+        self._running = 0
+        self._reservations: Dict[Path, int] = {}
+
+    def submit(self, episode: Episode, base_path: Path) -> Future:
+        return self._queue(episode, functools.partial(self._download, episode, base_path))
+
+    def _download(self, episode: Episode, base_path: Path) -> Path:
+        podcast_file = None
+        try:
+            podcast_file = episode.download_to(base_path, self.content, self.memory_folder, self.memory_limit, reserve=self.reserve)
+            return podcast_file
+        finally:
+            #a finished download keeps its room until complete() has moved it into the library
+            if not podcast_file and self.memory_folder:
+                self.release(self.memory_folder / str(episode))
+
+    def reserve(self, path: Path, length: int) -> bool:
+        """
+        Set aside room for length bytes at path if its folder has that much free beyond what the other downloads into it are yet to write
+        """
+        with self._lock:
+            pending = 0
+            for other, size in self._reservations.items():
+                if other != path:
+                    pending += max(0, size - (other.stat().st_size if other.exists() else 0))
+            if shutil.disk_usage(path.parent).free - pending <= length:
+                return False
+            self._reservations[path] = length
+            return True
+
+    def release(self, path: Path):
+        """
+        Give back the room set aside for path, once it has been moved out or removed
+        """
+        with self._lock:
+            self._reservations.pop(path, None)
+
+    def measure(self, episode: Episode) -> Future:
+        return self._queue(episode, episode.size)
+
+    def _queue(self, episode: Episode, job: Callable) -> Future:
+        future = Future()
+        with self._lock:
+            self._pending.append((self._host(episode.url), episode, job, future))
+        self._dispatch()
+        return future
+
+    def shutdown(self):
+        self._pool.shutdown(wait=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.shutdown()
+
+    @staticmethod
+    def _host(url: str) -> str:
+        return urlsplit(url).hostname or ''
+
+    def _dispatch(self):
+        with self._lock:
+            for job in list(self._pending):
+                if self._running >= self.workers:
+                    break
+                host = job[0]
+                if self._active[host] >= self.per_host:
+                    continue
+                self._pending.remove(job)
+                self._active[host] += 1
+                self._running += 1
+                self._pool.submit(self._run, *job)
+
+    def _run(self, host: str, episode: Episode, job: Callable, future: Future):
+        try:
+            if future.set_running_or_notify_cancel():
+                future.set_result(job())
+        except BaseException as e:
+            logging.debug(F"Fetch of {episode} failed with {e!r}")
+            future.set_exception(e)
+        finally:
+            with self._lock:
+                self._active[host] -= 1
+                self._running -= 1
+            self._dispatch()
@@ -1,18 +1,18 @@
 
 import collections
+import hashlib
+import json
 import logging
 import mimetypes
-import mutagen
-from mutagen import easymp4
-from mutagen.id3 import APIC, PictureType, Encoding
-from mutagen.mp3 import MP3
-from mutagen.mp4 import MP4, MP4Cover
+import os
+import re
 from pathlib import Path
-import r128gain
 import shutil
 import traceback
-import urllib3
+from typing import Callable, Tuple
 
+from Http import Http
+from Metrics import Metrics
 from util import *
 
 mimetypes.add_type('audio/mp3', '.mp3')
@@ -20,11 +20,22 @@ mimetypes.add_type('audio/mpeg', '.mp3')
 mimetypes.add_type('audio/mp4', '.m4a')
 mimetypes.add_type('audio/x-m4a', '.m4a')
 
-mutagen.easymp4.EasyMP4Tags.RegisterTextKey('catalognumber','egid')
-mutagen.easymp4.EasyMP4Tags.RegisterTextKey('website','purl')
+def _mutagen():
+    """
+    Import mutagen the first time an audio file is opened, so runs with nothing to download never load it
+    """
+    import mutagen
+    from mutagen import easymp4
+    if 'catalognumber' not in easymp4.EasyMP4Tags.Get:
+        easymp4.EasyMP4Tags.RegisterTextKey('catalognumber','egid')
+        easymp4.EasyMP4Tags.RegisterTextKey('website','purl')
+    return mutagen
 
 class Episode:
 
+    RESUME_ATTEMPTS: int = 5
+    CHUNK: int = 64 * 1024
+
     def __init__(self, url: str, number: int, title: str, author: str, album: str, date: str, extension: str, guid: str, cover_image: 'Image'=None):
         self.url = url
         self.number = int(number)
@@ -35,32 +46,34 @@ class Episode:
         self.extension = extension
         self.guid = guid
         self.cover_image = cover_image
+        self.digest: str = None
+        self.duplicate_of: Path = None
 
     @classmethod
-    def create(cls, author: str, album: str, episode: dict, cover_image: 'Image') -> 'Episode':
+    def create(cls, author: str, album: str, episode: dict, cover_image: 'Image', log=logging) -> 'Episode':
         try:
             if not 'enclosure' in episode:
-                logging.info(F"Entry {author} - {album} - {episode['title']} is not an episode.")
+                log.info(F"Entry {author} - {album} - {episode['title']} is not an episode.")
                 return Blank()
             url = episode['enclosure']['@url']
             if not url:
                 return None
 
-            logging.debug(F"Creating episode from { dict({ part:episode[part] for part in ['enclosure', 'title', 'pubDate', 'guid'] }, **{'author':author, 'album': album}) }")
+            log.debug(F"Creating episode from { dict({ part:episode[part] for part in ['enclosure', 'title', 'pubDate', 'guid'] }, **{'author':author, 'album': album}) }")
 
             guid = episode['guid']['#text'] if type(episode['guid']) == collections.OrderedDict else episode['guid']
 
-            title = clean_title(episode['title'])
-            author = remove_unicode(author)
-            album = remove_unicode(album)
+            title = clean_title(episode['title'], log)
+            author = remove_unicode(author, log)
+            album = remove_unicode(album, log)
             date = convert_date(episode['pubDate'])
             episode_number = tracknumber_from_date(date)
-            extension = cls._guess_extension(episode['enclosure']['@type'], url)
+            extension = cls._guess_extension(episode['enclosure']['@type'], url, log)
 
             if guid and episode_number and title and author and album and date and url and extension :
                 return cls(url, episode_number, title, author, album, date, extension, guid, cover_image)
         except KeyError as e:
-            logging.warning(F"Unable to find key {e} while creating Episode of {author} - {album}")
+            log.warning(F"Unable to find key {e} while creating Episode of {author} - {album}")
 
         return None
 
@@ -68,7 +81,7 @@ class Episode:
     def load(cls, file_path: Path) -> 'Episode':
         file_string = str(file_path)
         try:
-            audio = mutagen.File(file_string, easy=True)
+            audio = _mutagen().File(file_string, easy=True)
 
             return cls(
                 url = audio['website'][0],
@@ -86,15 +99,51 @@ class Episode:
             set_error(1)
         return None
 
-    def download_to(self, base_path: Path) -> Path:
-        podcast_file = base_path / str(self)
+    def download_to(self, base_path: Path, content: 'ContentIndex' = None, memory_folder: Path = None, memory_limit: int = 0, reserve: Callable[[Path, int], bool] = None) -> Path:
+        """
+        Fetch the enclosure into base_path and tag it, copying it from the library instead when the same enclosure is already there
 
-        logging.info(F"Downloading {podcast_file.name}")
+        An enclosure no longer than memory_limit goes to memory_folder instead, a tmpfs, so it is only written to disk once moved into the library,
+        if reserve, shared by the concurrent downloads, agrees there is room for it
+        """
+        podcast_file = base_path / str(self)
+        self.digest, self.duplicate_of = content.find(url=self.url) if content else (None, None)
+
+        if not self.duplicate_of:
+            logging.info(F"Downloading {podcast_file.name}")
+            with Metrics.timer('download', Http.host(self.url)):
+                response = None
+                if memory_folder and memory_limit:
+                    podcast_file, response = self._choose_location(self.url, podcast_file, memory_folder, memory_limit, reserve)
+                self.digest = self._download(self.url, to=podcast_file, response=response)
+            if not self.digest:
+                if memory_folder and podcast_file.parent == memory_folder:
+                    #a partial download in memory is never resumed, so give its room back
+                    self._discard(podcast_file)
+                return None
+            if content:
+                self.duplicate_of = content.find(digest=self.digest)[1]
+                if self.duplicate_of:
+                    podcast_file.unlink()
 
-        self._download(self.url, to=podcast_file)
-        self._tag_episode(podcast_file)
-        self._add_cover_image(self.cover_image, podcast_file)
-        self._replay_gain(podcast_file)
+        try:
+            if self.duplicate_of:
+                #an interrupted download of this enclosure may have been left behind
+                self._discard(podcast_file)
+                logging.info(F"Copying {podcast_file.name} from {self.duplicate_of.name}")
+                with Metrics.timer('duplicate'):
+                    linked = self._duplicate(self.duplicate_of, podcast_file)
+                Metrics.count('episodes_duplicated', by='link' if linked else 'copy')
+                if linked:
+                    return podcast_file
+
+            with Metrics.timer('tag'):
+                self._tag(podcast_file, replace_cover=bool(self.duplicate_of))
+        except:
+            if memory_folder and podcast_file.parent == memory_folder:
+                #nothing will move it out of memory now
+                self._discard(podcast_file)
+            raise
 
         return podcast_file if podcast_file.exists() else None
 
@@ -110,6 +159,22 @@ class Episode:
             self.url,
         ])
 
+    @classmethod
+    def deserialise(cls, serialised: str) -> 'Episode':
+        tok = serialised.split('\t', 7)
+        return cls(author=tok[0], album=tok[1], date=tok[2], number=tok[3], title=tok[4], guid=tok[5], extension=tok[6], url=tok[7])
+
+    def identity(self) -> tuple:
+        return (self.author, self.album, self.date, self.guid)
+
+    @staticmethod
+    def identity_of(serialised: str) -> tuple:
+        """
+        Identity of a serialised episode, matching identity() without building an Episode
+        """
+        tok = serialised.split('\t', 6)
+        return (tok[0], tok[1], tok[2], tok[5])
+
     def lookup(self, record: list) -> bool:
         prefix = "\t".join([
             self.author,
@@ -120,19 +185,18 @@ class Episode:
         right_result = string_prefix_comparator_right(prefix)
         possible_matches = record[GenericBisect.bisect(record,left_result):GenericBisect.bisect(record,right_result)]
         for match in possible_matches:
-            tok = match.split('\t')
-            other = Episode(author=tok[0], album=tok[1], date=tok[2], number=tok[3], title=tok[4], guid=tok[5], extension=tok[6], url=tok[7])
+            other = Episode.deserialise(match)
             if other == self:
                 return True
         return False
 
     @classmethod
-    def _guess_extension(cls, mimetype: str, url: str) -> str:
+    def _guess_extension(cls, mimetype: str, url: str, log=logging) -> str:
         extensions =  mimetypes.guess_all_extensions(mimetype)
-        logging.debug(F"Getting extentions {extensions} from {mimetype}")
+        log.debug(F"Getting extentions {extensions} from {mimetype}")
 
         matches = [ extension for extension in extensions if extension in url ]
-        logging.debug(F"Of which {matches} matchs {url}")
+        log.debug(F"Of which {matches} matchs {url}")
 
         if len(matches) == 1:
             return matches[0]
@@ -140,64 +204,262 @@ class Episode:
         return extensions[0]
 
     @staticmethod
-    def _download(url: str, to: Path) :
+    def _discard(podcast_file: Path):
+        """
+        Remove a download and the sidecar tracking its progress
+        """
+        for path in [podcast_file, podcast_file.with_name(podcast_file.name + '.part')]:
+            if path.exists():
+                path.unlink()
+
+    def _duplicate(self, source: Path, podcast_file: Path) -> bool:
+        """
+        Hard link a library file holding exactly this episode, otherwise clone or copy it so it can be retagged; True if linked
+        """
+        if self == Episode.load(source):
+            try:
+                os.link(source, podcast_file)
+                return True
+            except OSError:
+                logging.debug(traceback.format_exc())
+        copy_file(source, podcast_file)
+        return False
+
+    def size(self) -> int:
+        """
+        Length of the enclosure in bytes without fetching it, asking for a single byte when HEAD is refused, or None if the host won't say
+        """
+        headers = {'Accept-Encoding': 'identity'}
+        with Metrics.timer('plan', Http.host(self.url)):
+            response = Http.request('HEAD', self.url, headers=headers)
+            if response.status < 400 and response.headers.get('Content-Length'):
+                return int(response.headers['Content-Length'])
+            response = Http.request('GET', self.url, headers=dict(headers, Range='bytes=0-0'), preload_content=False)
+            try:
+                content_range = re.match(r'bytes \d+-\d+/(\d+)', response.headers.get('Content-Range', ''))
+                if response.status == 206 and content_range:
+                    return int(content_range.group(1))
+                logging.debug(F"No size for {self.url} from HTTP {response.status}")
+                return None
+            finally:
+                if response.status == 206:
+                    response.read()
+                    response.release_conn()
+                else:
+                    #a server ignoring the range sends the whole enclosure, so drop the connection instead
+                    response.close()
+
+    @classmethod
+    def _choose_location(cls, url: str, to: Path, memory_folder: Path, memory_limit: int, reserve: Callable[[Path, int], bool] = None) -> Tuple[Path, 'urllib3.response.HTTPResponse']:
+        """
+        Start fetching url, choosing memory_folder over to if the enclosure is small enough and will fit, and return the response to carry on with
+        """
+        if to.with_name(to.name + '.part').exists():
+            #carry on with the partial download instead
+            return to, None
+        response = Http.request('GET', url, headers={'Accept-Encoding': 'identity'}, preload_content=False, retries=10)
+        length = response.headers.get('Content-Length')
+        if response.status != 200 or not length or int(length) > memory_limit:
+            return to, response
+        try:
+            memory_folder.mkdir(parents=True, exist_ok=True)
+            room = reserve(memory_folder / to.name, int(length)) if reserve else shutil.disk_usage(memory_folder).free > int(length)
+            if not room:
+                logging.debug(F"No room in {memory_folder} for {to.name}")
+                return to, response
+        except OSError:
+            logging.debug(traceback.format_exc())
+            return to, response
+        return memory_folder / to.name, response
+
+    @classmethod
+    def _download(cls, url: str, to: Path, response: 'urllib3.response.HTTPResponse' = None) -> str:
+        """
+        Download url to a file, resuming from a partial download left by an earlier attempt or run, returning the SHA-256 of its content
+        """
         logging.debug(F"Downloading {url} to {to}")
 
-        with urllib3.PoolManager() as http:
+        sidecar = to.with_name(to.name + '.part')
+        state = cls._partial_state(url, to, sidecar)
+        for attempt in range(cls.RESUME_ATTEMPTS):
             try:
-                with http.request('GET', url, preload_content=False, retries=10) as response, open(to, 'wb') as out_file:
-                    shutil.copyfileobj(response, out_file)
+                digest = cls._transfer(url, to, sidecar, state, response if attempt == 0 else None)
+                size = to.stat().st_size
+                if state.get('length') is None or size == state['length']:
+                    if sidecar.exists():
+                        sidecar.unlink()
+                    return digest.hexdigest()
+                logging.warning(F"Download of {url} stopped at {size} of {state['length']} bytes")
             except:
-                logging.error(F"Failed to download {url} to {to}")
+                logging.warning(F"Download of {url} interrupted")
                 logging.debug(traceback.format_exc())
-                set_error(1)
 
-    @staticmethod
-    def _replay_gain(podcast_file: Path) :
-        if podcast_file.exists() :
-            logging.debug(F"Compute replay gain of {podcast_file}")
-
-            error = r128gain.process([str(podcast_file)])
-            if error > 0 :
-                raise Exception(F"Unable to process gain on {podcast_file}")
+        logging.error(F"Failed to download {url} to {to}")
+        set_error(1)
+        return None
 
     @staticmethod
-    def _add_cover_image(cover_image: 'Image', podcast_file: Path) :
-        if podcast_file.exists() and cover_image :
-            metadata = mutagen.File(str(podcast_file), easy=False)
-            if type(metadata) == MP3 and not metadata.tags.getall('APIC'):
-                logging.info(F"Adding image tag")
-                metadata.tags.add(
-                    APIC(
-                        data=cover_image.data,
-                        mime=cover_image.type,
-                        encoding=Encoding.UTF8,
-                        type=PictureType.COVER_FRONT
-                    )
+    def _partial_state(url: str, to: Path, sidecar: Path) -> dict:
+        if sidecar.exists() and to.exists():
+            try:
+                state = json.loads(sidecar.read_text())
+                if state.get('url') == url:
+                    return state
+            except:
+                logging.debug(traceback.format_exc())
+        return {'url': url}
+
+    @classmethod
+    def _transfer(cls, url: str, to: Path, sidecar: Path, state: dict, response: 'urllib3.response.HTTPResponse' = None) -> 'hashlib._Hash':
+        """
+        Fetch what is missing of url into to, hashing the content as it is written, starting from response if the request was already made
+        """
+        offset = to.stat().st_size if 'length' in state and to.exists() else 0
+        headers = {'Accept-Encoding': 'identity'}
+        if offset:
+            headers['Range'] = F"bytes={offset}-"
+            validator = state.get('etag') or state.get('last_modified')
+            if validator:
+                headers['If-Range'] = validator
+
+        if response is None:
+            response = Http.request('GET', url, headers=headers, preload_content=False, retries=10)
+        finished = False
+        try:
+            if response.status == 416 and offset and offset == state.get('length'):
+                return cls._hash_file(to, offset)
+            if response.status >= 400:
+                raise Exception(F"HTTP {response.status} from {url}")
+            if response.status == 206:
+                content_range = re.match(r'bytes (\d+)-', response.headers.get('Content-Range', ''))
+                if not content_range or int(content_range.group(1)) != offset:
+                    raise Exception(F"Unexpected range {response.headers.get('Content-Range')} from {url}")
+                logging.info(F"Resuming {to.name} from {offset} bytes")
+            else:
+                offset = 0
+                length = response.headers.get('Content-Length')
+                state.update(
+                    length=int(length) if length else None,
+                    etag=response.headers.get('ETag'),
+                    last_modified=response.headers.get('Last-Modified'),
                 )
-                metadata.save()
-            elif type(metadata) == MP4 and not metadata.tags.get('covr'):
-                logging.info(F"Adding image tag to MP4")
-                imageformat = MP4Cover.FORMAT_PNG if mimetypes.guess_extension(cover_image.type) == '.png' else MP4Cover.FORMAT_JPEG
-                metadata['covr'] = [ MP4Cover(cover_image.data, imageformat=imageformat)]
-                metadata.save()
-            elif type(metadata) not in [MP3, MP4] :
-                raise TypeError(F"Unkown type {type(metadata)} tagging {str(self)}")
-            else :
-                logging.info(F"{podcast_file} already has an image")
-
-    def _tag_episode(self, podcast_file: Path) :
-        if podcast_file.exists() :
-            metadata = mutagen.File(str(podcast_file), easy=True)
-            metadata['album'] = self.album
-            metadata['artist'] = self.author
-            metadata['catalognumber'] = self.guid
-            metadata['date'] = self.date
-            metadata['genre'] = "Podcast"
-            metadata['tracknumber'] = [str(self.number)]
-            metadata['title'] = self.title
-            metadata['website'] = self.url
+                sidecar.write_text(json.dumps(state))
+
+            digest = cls._hash_file(to, offset)
+            with open(to, 'ab' if offset else 'wb') as out_file:
+                try:
+                    for chunk in iter(lambda: response.read(cls.CHUNK), b''):
+                        out_file.write(chunk)
+                        digest.update(chunk)
+                finally:
+                    Metrics.count('download_bytes', out_file.tell() - offset, host=Http.host(url))
+            finished = True
+            return digest
+        finally:
+            if finished:
+                response.release_conn()
+            else:
+                #the rest of the body may still be coming, so drop the connection rather than reuse it
+                response.close()
+
+    @classmethod
+    def _hash_file(cls, path: Path, length: int) -> 'hashlib._Hash':
+        """
+        Hash of the first length bytes of path, the part of a download kept from an earlier attempt
+        """
+        digest = hashlib.sha256()
+        if length:
+            with path.open(mode='rb') as partial:
+                while length > 0:
+                    chunk = partial.read(min(cls.CHUNK, length))
+                    if not chunk:
+                        break
+                    digest.update(chunk)
+                    length -= len(chunk)
+        return digest
+
+    def _tag(self, podcast_file: Path, replace_cover: bool = False) :
+        """
+        Write the episode details and cover image in a single open and save, skipping the save if nothing changed
+        """
+        if not podcast_file.exists() :
+            return
+        from mutagen.mp3 import MP3
+        from mutagen.mp4 import MP4
+        metadata = _mutagen().File(str(podcast_file), easy=False)
+        if type(metadata) == MP3 :
+            changed = self._tag_id3(metadata, replace_cover)
+        elif type(metadata) == MP4 :
+            changed = self._tag_mp4(metadata, replace_cover)
+        else :
+            raise TypeError(F"Unkown type {type(metadata)} tagging {str(self)}")
+        if changed :
             metadata.save()
+        else :
+            logging.debug(F"{podcast_file} already tagged")
+
+    def _tag_id3(self, metadata: 'MP3', replace_cover: bool = False) -> bool:
+        from mutagen.id3 import APIC, PictureType, Encoding, TALB, TCON, TDRC, TIT2, TPE1, TRCK, TXXX, WOAR
+        if metadata.tags is None :
+            metadata.add_tags()
+        tags = metadata.tags
+        changed = False
+        for frame in [
+            TALB(encoding=Encoding.UTF8, text=[self.album]),
+            TPE1(encoding=Encoding.UTF8, text=[self.author]),
+            TXXX(encoding=Encoding.UTF8, desc='CATALOGNUMBER', text=[self.guid]),
+            TDRC(encoding=Encoding.UTF8, text=[self.date]),
+            TCON(encoding=Encoding.UTF8, text=["Podcast"]),
+            TRCK(encoding=Encoding.UTF8, text=[str(self.number)]),
+            TIT2(encoding=Encoding.UTF8, text=[self.title]),
+            WOAR(url=self.url),
+        ]:
+            # TXXX frames are told apart by their description, everything else is replaced outright
+            key = frame.HashKey if frame.FrameID == 'TXXX' else frame.FrameID
+            if [ existing.pprint() for existing in tags.getall(key) ] != [ frame.pprint() ]:
+                tags.delall(key)
+                tags.add(frame)
+                changed = True
+        if self.cover_image and replace_cover:
+            tags.delall('APIC')
+        if self.cover_image and not tags.getall('APIC'):
+            logging.info(F"Adding image tag")
+            tags.add(
+                APIC(
+                    data=self.cover_image.data,
+                    mime=self.cover_image.type,
+                    encoding=Encoding.UTF8,
+                    type=PictureType.COVER_FRONT
+                )
+            )
+            changed = True
+        return changed
+
+    def _tag_mp4(self, metadata: 'MP4', replace_cover: bool = False) -> bool:
+        from mutagen.mp4 import MP4Cover
+        if metadata.tags is None :
+            metadata.add_tags()
+        tags = metadata.tags
+        changed = False
+        for key, value in [
+            ('\xa9alb', [self.album]),
+            ('\xa9ART', [self.author]),
+            ('egid', [self.guid]),
+            ('\xa9day', [self.date]),
+            ('\xa9gen', ["Podcast"]),
+            ('trkn', [(int(self.number), 0)]),
+            ('\xa9nam', [self.title]),
+            ('purl', [self.url]),
+        ]:
+            if tags.get(key) != value:
+                tags[key] = value
+                changed = True
+        if self.cover_image and (replace_cover or not tags.get('covr')):
+            logging.info(F"Adding image tag to MP4")
+            imageformat = MP4Cover.FORMAT_PNG if mimetypes.guess_extension(self.cover_image.type) == '.png' else MP4Cover.FORMAT_JPEG
+            tags['covr'] = [ MP4Cover(self.cover_image.data, imageformat=imageformat) ]
+            changed = True
+        return changed
 
     def _filename(self) -> str:
         by = self.author if self.album == self.author or not self.album else F"{self.author} - {self.album}"
@@ -206,7 +468,8 @@ class Episode:
     def __eq__(self, other):
         if not other:
             return False
-        logging.debug(F"Comparing to another file {(self.number, other.number, self.number == other.number)} and {(self.title, other.title, self.title == other.title)} and {(self.author, other.author, self.author == other.author)} and {(self.album, other.album, self.album == other.album)} and {(self.date, other.date, self.date == other.date)} and {(self.extension, other.extension, self.extension == other.extension)} and {(self.guid, other.guid, self.guid == other.guid)}")
+        if logging.getLogger().isEnabledFor(logging.DEBUG):
+            logging.debug(F"Comparing to another file {(self.number, other.number, self.number == other.number)} and {(self.title, other.title, self.title == other.title)} and {(self.author, other.author, self.author == other.author)} and {(self.album, other.album, self.album == other.album)} and {(self.date, other.date, self.date == other.date)} and {(self.extension, other.extension, self.extension == other.extension)} and {(self.guid, other.guid, self.guid == other.guid)}")
         return (
         self.number == other.number and
         self.title == other.title and
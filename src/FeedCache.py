@@ -0,0 +1,83 @@
+import hashlib
+import json
+import logging
+from pathlib import Path
+import traceback
+from typing import Dict, List
+
+class FeedCache:
+    """
+    Keeps each feed's ETag and Last-Modified validators, with a compact copy of its items, so unchanged feeds can be skipped
+    """
+
+    def __init__(self, folder: Path, read_only: bool = False):
+        self.folder = folder
+        self.read_only = read_only
+        self._entries: Dict[str, Dict] = {}
+
+    def _path(self, url: str) -> Path:
+        return self.folder / (hashlib.sha1(url.encode('utf-8')).hexdigest() + '.json')
+
+    def load(self, url: str) -> Dict:
+        if url in self._entries:
+            return self._entries[url]
+        path = self._path(url)
+        if path.exists():
+            try:
+                entry = json.loads(path.read_text())
+                if entry.get('url') == url:
+                    self._entries[url] = entry
+                    return entry
+            except:
+                logging.warning(F"Ignoring unreadable feed cache {path}")
+                logging.debug(traceback.format_exc())
+        return {}
+
+    def validators(self, url: str) -> Dict[str, str]:
+        entry = self.load(url)
+        headers = {}
+        if entry.get('etag'):
+            headers['If-None-Match'] = entry['etag']
+        if entry.get('last_modified'):
+            headers['If-Modified-Since'] = entry['last_modified']
+        return headers
+
+    def items(self, url: str) -> List[dict]:
+        return self.load(url).get('items', [])
+
+    def store(self, url: str, headers: Dict[str, str], items: List[dict]):
+        if self.read_only:
+            return
+        entry = {
+            'url': url,
+            'etag': headers.get('ETag'),
+            'last_modified': headers.get('Last-Modified'),
+            'items': [ self.compact(item) for item in items ],
+        }
+        self._entries[url] = entry
+        self.folder.mkdir(parents=True, exist_ok=True)
+        path = self._path(url)
+        temp_file = path.with_suffix('.tmp')
+        temp_file.write_text(json.dumps(entry, separators=(',', ':')))
+        temp_file.replace(path)
+
+    def invalidate(self, url: str):
+        """
+        Drop the validators but keep the items, so the next run fetches the feed in full
+        """
+        if self.read_only:
+            return
+        entry = self.load(url)
+        if entry.get('etag') or entry.get('last_modified'):
+            self.store(url, {}, entry.get('items', []))
+
+    @staticmethod
+    def compact(item: dict) -> dict:
+        enclosure = item.get('enclosure') or {}
+        guid = item.get('guid')
+        return {
+            'title': item.get('title'),
+            'pubDate': item.get('pubDate'),
+            'guid': guid.get('#text') if isinstance(guid, dict) else guid,
+            'enclosure': { key:enclosure[key] for key in ['@url', '@type'] if key in enclosure },
+        }
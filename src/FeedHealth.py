@@ -0,0 +1,115 @@
+import hashlib
+import json
+import logging
+import os
+from pathlib import Path
+import tempfile
+import threading
+import time
+import traceback
+from typing import Dict
+from urllib.parse import urlsplit
+
+class FeedHealth:
+    """
+    Keeps each feed's run of failures and when it may next be tried, backing off exponentially, and stops trying a host whose feeds keep failing to answer
+    """
+
+    def __init__(self, folder: Path, read_only: bool = False, backoff: float = 60*60, max_backoff: float = 7*24*60*60, host_failures: int = 3):
+        self.folder = folder
+        self.read_only = read_only
+        self.backoff = backoff
+        self.max_backoff = max(backoff, max_backoff)
+        self.host_failures = max(1, host_failures)
+        self._entries: Dict[str, Dict] = {}
+        self._lock = threading.Lock()
+
+    def _path(self, key: str) -> Path:
+        return self.folder / (hashlib.sha1(key.encode('utf-8')).hexdigest() + '.json')
+
+    def load(self, key: str) -> Dict:
+        """
+        State of a feed by its URL, or of a host by 'host:' and its name
+        """
+        with self._lock:
+            if key in self._entries:
+                return self._entries[key]
+            entry = self._read(key) or { 'key':key, 'failures':0, 'last_success':None, 'next_attempt':0 }
+            self._entries[key] = entry
+            return entry
+
+    def _read(self, key: str) -> Dict:
+        path = self._path(key)
+        if path.exists():
+            try:
+                stored = json.loads(path.read_text())
+                if stored.get('key') == key:
+                    return stored
+            except:
+                logging.warning(F"Ignoring unreadable feed health {path}")
+                logging.debug(traceback.format_exc())
+        return None
+
+    def _store(self, entry: Dict):
+        """
+        Write an entry, holding the lock as feeds on the same host share their host's entry
+        """
+        if self.read_only:
+            return
+        self.folder.mkdir(parents=True, exist_ok=True)
+        #host entries are written by every worker with a feed on that host
+        descriptor, temp_file = tempfile.mkstemp(dir=self.folder, suffix='.tmp')
+        try:
+            with os.fdopen(descriptor, 'w') as output:
+                output.write(json.dumps(entry, separators=(',', ':')))
+            os.replace(temp_file, self._path(entry['key']))
+        except:
+            os.unlink(temp_file)
+            raise
+
+    @staticmethod
+    def _host(url: str) -> str:
+        #servers on other ports of the same machine fail independently
+        return urlsplit(url).netloc
+
+    def _delay(self, failures: int) -> float:
+        return min(self.max_backoff, self.backoff * 2 ** min(failures - 1, 32))
+
+    def blocked(self, url: str, now: float) -> str:
+        """
+        Why url should not be fetched before its backoff expires, or None if it may be
+        """
+        host = self._host(url)
+        for key, what in [(F"host:{host}", F"host {host}"), (url, "feed")]:
+            entry = self.load(key)
+            if entry['next_attempt'] > now:
+                return F"{what} failed {entry['failures']} times in a row, next try {time.strftime('%Y-%m-%d %H:%M', time.localtime(entry['next_attempt']))}"
+        return None
+
+    def succeeded(self, url: str, now: float):
+        """
+        Clear the failures of url and its host, keeping their last success to within backoff rather than writing on every run
+        """
+        for key in [url, F"host:{self._host(url)}"]:
+            entry = self.load(key)
+            if entry['failures'] or entry['last_success'] is None or now - entry['last_success'] >= self.backoff:
+                with self._lock:
+                    entry.update(failures=0, last_success=now, next_attempt=0)
+                    self._store(entry)
+
+    def failed(self, url: str, now: float, unreachable: bool = False):
+        """
+        Push back the next attempt at url and, if it could not be reached at all, count it against its host
+        """
+        keys = [url, F"host:{self._host(url)}"] if unreachable else [url]
+        for key in keys:
+            entry = self.load(key)
+            with self._lock:
+                if key != url and not self.read_only:
+                    #other workers count failures against the same host
+                    entry.update(self._read(key) or {})
+                entry['failures'] += 1
+                #a host is only given up on once several of its feeds have failed
+                failures = entry['failures'] if key == url else entry['failures'] - self.host_failures + 1
+                entry['next_attempt'] = now + self._delay(failures) if failures > 0 else 0
+                self._store(entry)
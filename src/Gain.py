@@ -0,0 +1,61 @@
+import logging
+import os
+from pathlib import Path
+import traceback
+from typing import List, Tuple
+
+from Metrics import Metrics
+from util import *
+
+class Gain:
+    """
+    Collects finished downloads and computes their replay gain in batches, one ffmpeg analysis per core
+    """
+
+    def __init__(self, batch_size: int = 16, threads: int = None):
+        self.batch_size = max(1, batch_size)
+        self.threads = threads or os.cpu_count() or 1
+        self.pending: List[Tuple[Path, object, bool]] = []
+
+    def add(self, podcast_file: Path, item: object, analyse: bool = True) -> List[Tuple[object, Path, bool]]:
+        """
+        Queue a file for analysis, or just a check of its existing tags, returning the results of the batch if this filled it
+        """
+        self.pending.append((podcast_file, item, analyse))
+        if len(self.pending) >= self.batch_size:
+            return self.flush()
+        return []
+
+    def flush(self) -> List[Tuple[object, Path, bool]]:
+        batch, self.pending = self.pending, []
+        files = [ podcast_file for podcast_file, item, analyse in batch if analyse and podcast_file.exists() ]
+        if files:
+            logging.debug(F"Compute replay gain of {len(files)} files")
+            try:
+                import r128gain
+                with Metrics.timer('gain'):
+                    r128gain.process([ str(podcast_file) for podcast_file in files ], thread_count=min(self.threads, len(files)))
+            except:
+                logging.error(F"Replay gain analysis failed for a batch of {len(files)} files")
+                logging.debug(traceback.format_exc())
+
+        results = []
+        for podcast_file, item, analyse in batch:
+            analysed = self._analysed(podcast_file)
+            if not analysed:
+                logging.error(F"Unable to process gain on {podcast_file}")
+                set_error(1)
+            results.append((item, podcast_file, analysed))
+        return results
+
+    @staticmethod
+    def _analysed(podcast_file: Path) -> bool:
+        if not podcast_file.exists():
+            return False
+        try:
+            import r128gain
+            tags = r128gain.has_loudness_tag(str(podcast_file))
+            return bool(tags and tags[0])
+        except:
+            logging.debug(traceback.format_exc())
+            return False
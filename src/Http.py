@@ -0,0 +1,48 @@
+import threading
+from urllib.parse import urlsplit
+import urllib3
+
+class Http:
+    """
+    Process wide pooled HTTP client so feeds, covers and episodes from the same host reuse kept-alive connections
+    """
+
+    pool_size: int = 8
+    connect_timeout: float = 10.0
+    read_timeout: float = 60.0
+
+    _pool: urllib3.PoolManager = None
+    _lock = threading.Lock()
+
+    @classmethod
+    def configure(cls, pool_size: int = None, connect_timeout: float = None, read_timeout: float = None):
+        with cls._lock:
+            if pool_size:
+                cls.pool_size = pool_size
+            if connect_timeout:
+                cls.connect_timeout = connect_timeout
+            if read_timeout:
+                cls.read_timeout = read_timeout
+            if cls._pool:
+                cls._pool.clear()
+                cls._pool = None
+
+    @classmethod
+    def pool(cls) -> urllib3.PoolManager:
+        with cls._lock:
+            if not cls._pool:
+                cls._pool = urllib3.PoolManager(
+                    num_pools=64,
+                    maxsize=cls.pool_size,
+                    timeout=urllib3.Timeout(connect=cls.connect_timeout, read=cls.read_timeout),
+                    retries=urllib3.Retry(3, redirect=10),
+                )
+            return cls._pool
+
+    @staticmethod
+    def host(url: str) -> str:
+        return urlsplit(url).hostname or ''
+
+    @classmethod
+    def request(cls, method: str, url: str, **kwargs) -> urllib3.response.HTTPResponse:
+        return cls.pool().request(method, url, **kwargs)
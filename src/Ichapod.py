@@ -1,40 +1,74 @@
 #!/usr/bin/env python3
 
 import argparse
+from collections import deque
+from concurrent import futures
+from concurrent.futures import Future, ThreadPoolExecutor
 import datetime
+import json
 import logging, logging.config
 import mimetypes
 from pathlib import Path
+import signal
 import sys
+import time
 import traceback
-from typing import Iterator
+from typing import Iterator, List
 
+from ContentIndex import ContentIndex
+from CoverCache import CoverCache
+from Downloader import Downloader
 from Episode import Episode
+from FeedCache import FeedCache
+from FeedHealth import FeedHealth
+from Gain import Gain
+from Http import Http
+from Leases import Leases
+from Library import Library
+from Metrics import Metrics
 from Podcast import Podcast
 from Record import Record
-from util import set_error, get_error
-
-parser = argparse.ArgumentParser(description='Download podcasts.')
-parser.add_argument('podcast_list', type=Path, help='Podcast list')
-parser.add_argument('destination_folder', type=Path, help='Where podcasts are saved')
-parser.add_argument('--temp_download_location', type=Path, default='/tmp/downloaded_episode', help='Where podcasts are saved')
-parser.add_argument('--log-config', type=Path, default='/opt/ichapod/log.conf', help='Logging config file name')
-parser.add_argument('--dry-run', '-n', action='store_true', help='Don\'t run the real fetcher')
-parser.add_argument('--over-write', '-f', action='store_true', help='Replace an existing file if found')
-log_arg = parser.add_mutually_exclusive_group()
-log_arg.add_argument('--debug', action='store_true', help='Logging to debug')
-log_arg.add_argument('--quiet', '-q', action='store_true', help='Logging to quiet')
-
-args = parser.parse_args()
-
-logging.config.fileConfig(args.log_config)
-
-if args.quiet:
-    log_level = logging.WARNING
-elif args.debug:
-    log_level = logging.DEBUG
-else:
-    log_level = logging.INFO
+from Schedule import Schedule
+from util import set_error, get_error, place_file
+
+def parse_args(argv: List[str] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description='Download podcasts.')
+    parser.add_argument('podcast_list', type=Path, help='Podcast list')
+    parser.add_argument('destination_folder', type=Path, help='Where podcasts are saved')
+    parser.add_argument('--temp_download_location', type=Path, default='/tmp/downloaded_episode', help='Where podcasts are saved')
+    parser.add_argument('--log-config', type=Path, default='/opt/ichapod/log.conf', help='Logging config file name')
+    parser.add_argument('--dry-run', '-n', action='store_true', help='Don\'t run the real fetcher')
+    parser.add_argument('--plan', type=Path, default=None, help='Only ask for the size of each new episode, writing what a real run would fetch as JSON to this file, or - for standard output')
+    parser.add_argument('--over-write', '-f', action='store_true', help='Replace an existing file if found')
+    parser.add_argument('--feed-workers', type=int, default=8, help='Number of feeds fetched at once')
+    parser.add_argument('--stop-after-known', type=int, default=50, help='Stop reading a feed after this many consecutive recorded episodes, 0 reads every item')
+    parser.add_argument('--compact-every', type=int, default=1000, help='Merge the download journal into the record once it holds this many entries')
+    parser.add_argument('--map-record', action='store_true', help='Search the download record in place instead of loading it')
+    parser.add_argument('--download-workers', type=int, default=4, help='Number of episodes downloaded at once')
+    parser.add_argument('--memory-location', type=Path, default=None, help='A tmpfs folder where small episodes are downloaded, tagged and analysed before being written to the destination')
+    parser.add_argument('--memory-episode-size', type=float, default=50, help='Megabytes up to which an episode is downloaded to the memory location')
+    parser.add_argument('--host-workers', type=int, default=2, help='Number of episodes downloaded at once from any one host')
+    parser.add_argument('--gain-batch', type=int, default=16, help='Number of episodes analysed for replay gain together')
+    parser.add_argument('--gain-threads', type=int, default=None, help='Number of replay gain analyses run at once, defaults to one per core')
+    parser.add_argument('--http-pool-size', type=int, default=8, help='Connections kept alive per host')
+    parser.add_argument('--connect-timeout', type=float, default=10.0, help='Seconds to wait for a connection')
+    parser.add_argument('--read-timeout', type=float, default=60.0, help='Seconds to wait for data from a connection')
+    parser.add_argument('--rebuild-library-index', action='store_true', help='Rescan every file in the destination folder instead of updating podcasts')
+    parser.add_argument('--library-workers', type=int, default=8, help='Number of files read at once when rebuilding the library index')
+    parser.add_argument('--daemon', '-d', action='store_true', help='Keep running, refreshing each podcast as often as it publishes')
+    parser.add_argument('--min-poll', type=float, default=60, help='Minutes between refreshes of the busiest podcasts in daemon mode')
+    parser.add_argument('--max-poll', type=float, default=7*24*60, help='Minutes between refreshes of the quietest podcasts in daemon mode')
+    parser.add_argument('--list-check', type=float, default=60, help='Seconds between checks for changes to the podcast list in daemon mode')
+    parser.add_argument('--backoff', type=float, default=60, help='Minutes before a feed that failed is tried again, doubling with each failure in a row')
+    parser.add_argument('--max-backoff', type=float, default=7*24*60, help='Most minutes between tries of a failing feed')
+    parser.add_argument('--host-failures', type=int, default=3, help='Unreachable feeds in a row after which their whole host is backed off')
+    parser.add_argument('--worker', default=None, help='Name of this worker, letting several share one destination folder and podcast list')
+    parser.add_argument('--lease-time', type=float, default=6*60, help='Minutes before a feed claimed by a worker that stopped renewing it can be taken by another')
+    log_arg = parser.add_mutually_exclusive_group()
+    log_arg.add_argument('--debug', action='store_true', help='Logging to debug')
+    log_arg.add_argument('--quiet', '-q', action='store_true', help='Logging to quiet')
+
+    return parser.parse_args(argv)
 
 def podcast_list(filename: Path) -> Iterator['Podcast']:
     with open(filename, 'r') as podcast_list:
@@ -44,6 +78,52 @@ def podcast_list(filename: Path) -> Iterator['Podcast']:
                 yield podcast
             continue
 
+def refresh(podcasts: Iterator['Podcast'], workers: int, cache: FeedCache = None, record: Record = None, stop_after_known: int = 0, covers: CoverCache = None, leases: Leases = None, health: FeedHealth = None) -> Iterator['Podcast']:
+    """
+    Fetch the manifests of all podcasts on a bounded pool, yielding them in list order, less any backing off after failures
+
+    With leases, only podcasts no other worker has claimed are fetched, and each is claimed only a little ahead of being yielded
+    so that workers starting together share the list
+    """
+    def fetch(podcast: Podcast) -> Podcast:
+        #checked as each fetch starts, so a host found down stops the rest of its feeds being tried
+        blocked = health.blocked(podcast.url, time.time()) if health else None
+        if blocked:
+            Metrics.count('feeds', status='backoff')
+            logging.info(F"Skipping {podcast}, {blocked}")
+            return None
+        podcast.refresh(cache=cache, record=record, stop_after_known=stop_after_known, covers=covers)
+        try:
+            if health and podcast.failure:
+                health.failed(podcast.url, time.time(), podcast.unreachable)
+            elif health:
+                health.succeeded(podcast.url, time.time())
+        except OSError:
+            #only costs the backoff, never the run
+            logging.warning(F"Failed to save the health of {podcast.url}")
+            logging.debug(traceback.format_exc())
+        return podcast
+
+    workers = max(1, workers)
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        if not leases:
+            yield from filter(None, pool.map(fetch, podcasts))
+            return
+        fetching = deque()
+        for podcast in podcasts:
+            if not leases.claim(podcast.url):
+                logging.info(F"Skipping {podcast}, claimed by another worker")
+                continue
+            fetching.append(pool.submit(fetch, podcast))
+            if len(fetching) > workers:
+                fetched = fetching.popleft().result()
+                if fetched:
+                    yield fetched
+        while fetching:
+            fetched = fetching.popleft().result()
+            if fetched:
+                yield fetched
+
 def move(downloaded_file: Path, podcast_file: Path, over_write=False) -> bool :
     podcast_file.parent.mkdir(parents=True, exist_ok=True)
     if over_write and podcast_file.exists() :
@@ -54,67 +134,305 @@ def move(downloaded_file: Path, podcast_file: Path, over_write=False) -> bool :
         set_error(1)
         return False
     try:
-        with podcast_file.open(mode='xb') as output:
-            output.write(downloaded_file.read_bytes())
-            downloaded_file.unlink()
+        place_file(downloaded_file, podcast_file)
         return True
+    except FileExistsError:
+        logging.error(F"{podcast_file} already exists")
+        set_error(1)
+        return False
     except:
         logging.error(F"Unable to copy {downloaded_file} to {podcast_file}")
         set_error(1)
         return False
 
+def collect(episode: Episode, download: Future) -> Path:
+    """
+    Wait for a queued download, returning the downloaded file if it succeeded
+    """
+    try:
+        downloaded_file = download.result()
+    except:
+        logging.error(F"Episode {episode} failed to download ({traceback.format_exc()})")
+        set_error(1)
+        downloaded_file = None
+    if downloaded_file:
+        Metrics.count('episodes_downloaded')
+    else:
+        Metrics.count('episodes_failed', stage='download')
+        logging.error(F"Episode {episode} not downloaded")
+    return downloaded_file
 
-if __name__ == "__main__":
+def finalise(episode: Episode, podcast_file: Path, downloaded_file: Path, record: Record, library: Library, content: ContentIndex, store_location: Path, actual_run=True, over_write=False):
+    moved = False
+    if actual_run:
+        with Metrics.timer('move'):
+            moved = move(downloaded_file, podcast_file, over_write)
+    if moved:
+        Metrics.count('episodes_stored')
+        logging.info(F"Fetch completed for {podcast_file.relative_to(store_location)}")
+        #store result to avoid repetition
+        record.store(episode)
+        library.update(podcast_file, episode)
+        content.store(episode.digest, episode.url, podcast_file)
+    elif downloaded_file.exists():
+        downloaded_file.unlink()
+        logging.info(F"Dry-run fetch completed for {podcast_file.relative_to(store_location)}")
+
+def complete(downloads: deque, gain: Gain, record: Record, library: Library, content: ContentIndex, feed_cache: FeedCache, store_location: Path, actual_run=True, over_write=False, wait=False, downloader: Downloader = None):
+    """
+    Pass finished downloads, in the order they were queued, through replay gain and into the library
+    """
+    analysed = []
+    while downloads and (wait or downloads[0][3].done()):
+        podcast, episode, podcast_file, download = downloads.popleft()
+        downloaded_file = collect(episode, download)
+        if downloaded_file:
+            #a copy of a library file carries its replay gain already
+            analysed += gain.add(downloaded_file, (podcast, episode, podcast_file), analyse=not episode.duplicate_of)
+        else:
+            #make sure the next run sees the whole feed again
+            podcast.settle(feed_cache, failed=True)
+    if wait:
+        analysed += gain.flush()
+    for (podcast, episode, podcast_file), downloaded_file, success in analysed:
+        if success:
+            finalise(episode, podcast_file, downloaded_file, record, library, content, store_location, actual_run, over_write)
+            podcast.settle(feed_cache)
+        else:
+            Metrics.count('episodes_failed', stage='gain')
+            if downloaded_file.exists():
+                downloaded_file.unlink()
+            podcast.settle(feed_cache, failed=True)
+        if downloader:
+            downloader.release(downloaded_file)
+
+def update(args: argparse.Namespace, podcasts: Iterator['Podcast'], record: Record, library: Library, content: ContentIndex, feed_cache: FeedCache, covers: CoverCache, downloader: Downloader, gain: Gain, leases: Leases = None, health: FeedHealth = None):
+    """
+    Refresh the podcasts and fetch every episode not already in the library, skipping those claimed by other workers
+    """
+    actual_run = not args.dry_run
+    podcast_store_location = args.destination_folder
+    downloads = deque()
+    queued = set()
+    enclosures = set()
+    deferred = []
+    planned = []
+
+    def queue(podcast: Podcast, episode: Episode):
+        #skip already downloaded
+        podcast_file = podcast_store_location / str(podcast) / str(episode)
+        if record.check(episode):
+            Metrics.count('episodes_skipped', by='record')
+            logging.info(F"Skipping {episode}")
+            return
+        if podcast_file.exists() and episode == library.load(podcast_file):
+            Metrics.count('episodes_skipped', by='library')
+            logging.info(F"Skipping already downloaded {episode}")
+            record.store(episode)
+            return
+        if podcast_file in queued:
+            Metrics.count('episodes_skipped', by='duplicate')
+            logging.info(F"Skipping duplicate {episode}")
+            return
+        if args.plan:
+            #a real run copies an enclosure it has already fetched rather than fetching it again
+            shared = episode.url in enclosures or content.find(url=episode.url)[1]
+            queued.add(podcast_file)
+            enclosures.add(episode.url)
+            planned.append((episode, podcast_file, None if shared else downloader.measure(episode)))
+            return
+        #another feed's copy of the enclosure is on its way, so copy it once it is in the library
+        if episode.url in enclosures:
+            logging.info(F"Waiting for the shared enclosure of {episode}")
+            podcast.expect()
+            deferred.append((podcast, episode))
+            return
+        #if not episode exists
+        queued.add(podcast_file)
+        enclosures.add(episode.url)
+        podcast.expect()
+        downloads.append((podcast, episode, podcast_file, downloader.submit(episode, args.temp_download_location)))
+        if leases:
+            leases.renew()
+            #claim no further feeds than the downloads can keep up with, leaving the rest to other workers
+            while len(downloads) > 4 * args.download_workers:
+                futures.wait([downloads[0][3]])
+                complete(downloads, gain, record, library, content, feed_cache, podcast_store_location, actual_run, args.over_write, downloader=downloader)
+        complete(downloads, gain, record, library, content, feed_cache, podcast_store_location, actual_run, args.over_write, downloader=downloader)
+
+    try:
+        for podcast in refresh(podcasts, args.feed_workers, feed_cache, record, args.stop_after_known, covers, leases, health):
+            for episode in podcast.episodes():
+                queue(podcast, episode)
+            #the feed is saved once its last queued episode is in
+            podcast.settle(feed_cache)
+        complete(downloads, gain, record, library, content, feed_cache, podcast_store_location, actual_run, args.over_write, wait=True, downloader=downloader)
+
+        while deferred:
+            waiting, deferred = deferred, []
+            enclosures.clear()
+            for podcast, episode in waiting:
+                queue(podcast, episode)
+                podcast.settle(feed_cache)
+            complete(downloads, gain, record, library, content, feed_cache, podcast_store_location, actual_run, args.over_write, wait=True, downloader=downloader)
+        if args.plan:
+            write_plan(args.plan, planned, podcast_store_location)
+    finally:
+        if leases:
+            leases.release_all()
+
+def write_plan(plan_file: Path, planned: List[tuple], store_location: Path):
+    """
+    Write the episodes a real run would fetch, where each would be saved and how many bytes it would cost
+    """
+    episodes = []
+    for episode, podcast_file, size in planned:
+        entry = {
+            'episode': str(episode),
+            'url': episode.url,
+            'path': str(podcast_file.relative_to(store_location)),
+            'action': 'download' if size else 'copy',
+            'bytes': 0,
+        }
+        if size:
+            try:
+                entry['bytes'] = size.result()
+            except:
+                logging.warning(F"Unable to find the size of {episode}")
+                logging.debug(traceback.format_exc())
+                entry['bytes'] = None
+        episodes.append(entry)
+    plan = {
+        'episodes': episodes,
+        'downloads': sum( 1 for entry in episodes if entry['action'] == 'download' ),
+        'copies': sum( 1 for entry in episodes if entry['action'] == 'copy' ),
+        'total_bytes': sum( entry['bytes'] or 0 for entry in episodes ),
+        'unknown_sizes': sum( 1 for entry in episodes if entry['bytes'] is None ),
+    }
+    logging.info(F"Plan fetches {plan['downloads']} episodes of {plan['total_bytes']} bytes, {plan['unknown_sizes']} of unknown size, and copies {plan['copies']}")
+    text = json.dumps(plan, indent=1) + "\n"
+    if str(plan_file) == '-':
+        sys.stdout.write(text)
+    else:
+        temp_file = plan_file.with_name(plan_file.name + '.tmp')
+        temp_file.write_text(text)
+        temp_file.replace(plan_file)
+
+def write_metrics(store_location: Path, started: float, worker: str = None):
+    try:
+        Metrics.write(store_location, started, get_error(), worker)
+    except:
+        logging.warning(F"Unable to write metrics to {store_location}")
+        logging.debug(traceback.format_exc())
+
+def daemon(args: argparse.Namespace, record: Record, library: Library, content: ContentIndex, feed_cache: FeedCache, covers: CoverCache, downloader: Downloader, gain: Gain, leases: Leases = None, health: FeedHealth = None):
+    """
+    Keep running, refreshing each podcast when its schedule says it is due and reloading the list whenever it changes
+    """
+    schedule = Schedule(args.min_poll * 60, args.max_poll * 60)
+    listed = None
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    try:
+        while True:
+            modified = args.podcast_list.stat().st_mtime_ns
+            if modified != listed:
+                podcasts = list(podcast_list(args.podcast_list))
+                schedule.track(podcasts, { podcast.url:feed_cache.items(podcast.url) for podcast in podcasts }, time.time())
+                logging.info(F"Following {len(podcasts)} podcasts from list")
+                listed = modified
+
+            started = time.time()
+            due = schedule.due(started)
+            if due:
+                try:
+                    update(args, due, record, library, content, feed_cache, covers, downloader, gain, leases, health)
+                except Exception:
+                    logging.error(F"Update failed ({traceback.format_exc()})")
+                    set_error(1)
+                for podcast in due:
+                    schedule.polled(podcast, feed_cache.items(podcast.url), time.time())
+                if record.checkpoint():
+                    logging.info(F"Download record compacted")
+                library.close()
+                content.close()
+                #check each cover again on the next refresh, as a run would
+                covers.expire()
+                if not args.dry_run:
+                    write_metrics(args.destination_folder, started, args.worker)
+
+            time.sleep(min(schedule.wait(time.time()), args.list_check))
+    except KeyboardInterrupt:
+        logging.info("Stopping")
+
+def main(argv: List[str] = None) -> int:
+    args = parse_args(argv)
+
+    logging.config.fileConfig(args.log_config)
+
+    if args.quiet:
+        log_level = logging.WARNING
+    elif args.debug:
+        log_level = logging.DEBUG
+    else:
+        log_level = logging.INFO
+
+    started = time.time()
+    actual_run = not args.dry_run and not args.plan
     try :
-        actual_run = not args.dry_run
 
         logging.getLogger().setLevel(logging.INFO)
         logging.info(F"Starting update {datetime.datetime.now().replace(microsecond=0)}\n{'-'*43}")
-        if not actual_run :
+        if args.plan :
+            logging.info("Planning only")
+        elif not actual_run :
             logging.info("Performing dry-run")
         logging.info("Updating podcasts from list")
         if args.over_write :
             logging.warning("OVERWRITE IS ENABLED")
         logging.getLogger().setLevel(log_level)
 
+        Http.configure(args.http_pool_size, args.connect_timeout, args.read_timeout)
+
         temp_download_location = args.temp_download_location
         temp_download_location.mkdir(parents=True, exist_ok=True)
 
         podcast_store_location = args.destination_folder
 
-        record = Record(podcast_store_location / '.download_record')
+        #workers sharing the folder each journal their own downloads, and leave the indexes to be rebuilt by a single run
+        leases = Leases(podcast_store_location / '.leases', args.worker, args.lease_time * 60) if args.worker and not args.plan else None
+        record = Record(podcast_store_location / '.download_record', read_only=not actual_run, compact_every=args.compact_every, mapped=args.map_record, segment=args.worker, leases=leases)
+        feed_cache = FeedCache(podcast_store_location / '.feed_cache', read_only=not actual_run)
+        health = FeedHealth(podcast_store_location / '.feed_health', read_only=not actual_run, backoff=args.backoff * 60, max_backoff=args.max_backoff * 60, host_failures=args.host_failures)
+        covers = CoverCache(podcast_store_location / '.cover_cache', read_only=not actual_run)
+        library = Library(podcast_store_location, read_only=not actual_run or bool(args.worker))
+        content = ContentIndex(podcast_store_location, read_only=not actual_run or bool(args.worker))
 
-        for podcast in podcast_list(args.podcast_list):
-            for episode in podcast.episodes():
-                #skip already downloaded
-                podcast_file = podcast_store_location / str(podcast) / str(episode)
-                if record.check(episode):
-                    logging.info(F"Skipping {episode}")
-                    continue
-                if podcast_file.exists() and episode == Episode.load(podcast_file):
-                    logging.info(F"Skipping already downloaded {episode}")
-                    record.store(episode)
-                    continue
-                #if not episode exists
-                downloaded_file = episode.download_to(temp_download_location)
-                if actual_run and downloaded_file and move(downloaded_file, podcast_file, args.over_write):
-                    logging.info(F"Fetch completed for {podcast_file.relative_to(podcast_store_location)}")
-                    #store result to avoid repetition
-                    record.store(episode)
-                elif downloaded_file:
-                    downloaded_file.unlink()
-                    logging.info(F"Dry-run fetch completed for {podcast_file.relative_to(podcast_store_location)}")
-                else:
-                    logging.error(F"Episode {episode} not downloaded")
-
-        if actual_run:
-            record.sort()
-            logging.info(F"Download record updated")
+        downloader = Downloader(args.download_workers, args.host_workers, content, args.memory_location, int(args.memory_episode_size * 1024 * 1024))
+        gain = Gain(args.gain_batch, args.gain_threads)
+
+        if args.rebuild_library_index:
+            library.rebuild(args.library_workers)
+        elif args.daemon and not args.plan:
+            daemon(args, record, library, content, feed_cache, covers, downloader, gain, leases, health)
+        else:
+            update(args, podcast_list(args.podcast_list), record, library, content, feed_cache, covers, downloader, gain, leases, health)
+        downloader.shutdown()
+
+        if record.close():
+            logging.info(F"Download record compacted")
+        library.close()
+        content.close()
     except:
-        logging.error(F"Faital error with {episode or podcast or 'no info'} ({traceback.format_exc()})")
+        logging.error(F"Faital error ({traceback.format_exc()})")
         set_error(1)
 
+    if actual_run and not args.daemon:
+        write_metrics(args.destination_folder, started, args.worker)
+
     logging.getLogger().setLevel(logging.INFO)
     logging.info(F"Done updating\n{'='*43}")
 
-    sys.exit(get_error())
+    return get_error()
+
+if __name__ == "__main__":
+    sys.exit(main())
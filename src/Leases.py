@@ -0,0 +1,95 @@
+import hashlib
+import logging
+import os
+from pathlib import Path
+import time
+from typing import Dict
+
+class Leases:
+    """
+    Claims held by one worker on feeds and shared files, kept as files in a folder every worker can see so several can split one podcast list
+    """
+
+    def __init__(self, folder: Path, worker: str, duration: float = 6*60*60):
+        self.folder = folder
+        self.worker = worker
+        self.duration = duration
+        self.held: Dict[str, Path] = {}
+        self._renewed = time.time()
+        self.folder.mkdir(parents=True, exist_ok=True)
+
+    def _path(self, key: str) -> Path:
+        return self.folder / (hashlib.sha1(key.encode('utf-8')).hexdigest() + '.lease')
+
+    def claim(self, key: str) -> bool:
+        """
+        Take the lease on key unless another worker holds it and has renewed it within duration
+        """
+        if key in self.held:
+            return True
+        path = self._path(key)
+        #a second attempt only follows breaking a stale lease
+        for attempt in range(2):
+            try:
+                descriptor = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o644)
+            except FileExistsError:
+                if not self._break_stale(path, key):
+                    return False
+                continue
+            with os.fdopen(descriptor, 'w') as lease:
+                lease.write(F"{self.worker}\t{key}\n")
+            self.held[key] = path
+            return True
+        return False
+
+    def _break_stale(self, path: Path, key: str) -> bool:
+        try:
+            stale = path.stat()
+        except FileNotFoundError:
+            return True
+        if time.time() - stale.st_mtime < self.duration:
+            return False
+        #rename is atomic, so only one worker moves a given lease aside
+        aside = path.with_name(F"{path.name}.{self.worker}")
+        try:
+            os.rename(path, aside)
+        except FileNotFoundError:
+            return True
+        moved = aside.stat()
+        if (moved.st_ino, moved.st_mtime_ns) != (stale.st_ino, stale.st_mtime_ns):
+            #another worker broke it first and claimed it again, so give theirs back
+            try:
+                os.link(aside, path)
+            except FileExistsError:
+                pass
+            aside.unlink()
+            return False
+        aside.unlink()
+        logging.warning(F"Breaking stale lease on {key}")
+        return True
+
+    def renew(self, force: bool = False):
+        """
+        Touch every held lease, at most every quarter of duration unless forced
+        """
+        now = time.time()
+        if not force and now - self._renewed < self.duration / 4:
+            return
+        self._renewed = now
+        for key, path in self.held.items():
+            try:
+                os.utime(path)
+            except FileNotFoundError:
+                logging.warning(F"Lost the lease on {key}")
+
+    def release(self, key: str):
+        path = self.held.pop(key, None)
+        if path:
+            try:
+                path.unlink()
+            except FileNotFoundError:
+                pass
+
+    def release_all(self):
+        for key in list(self.held):
+            self.release(key)
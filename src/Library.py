@@ -0,0 +1,127 @@
+from concurrent.futures import ThreadPoolExecutor
+import logging
+import os
+from pathlib import Path
+import traceback
+from typing import Dict, Iterator, Tuple
+
+from Episode import Episode
+
+class Library:
+    """
+    Index of the destination folder mapping each file's path, size and modification time to the episode its tags hold
+    """
+
+    EXTENSIONS = {'.mp3', '.m4a'}
+
+    def __init__(self, folder: Path, read_only: bool = False):
+        self.folder = folder
+        self.index_path = folder / '.library_index'
+        self.read_only = read_only
+        self.entries: Dict[str, Tuple[int, int, str]] = {}
+        self._lines = 0
+        self._index = None
+        if self.index_path.exists():
+            with self.index_path.open(mode='r') as index:
+                for line in index:
+                    if not line.endswith('\n'):
+                        continue
+                    path, size, mtime, serialised = line.rstrip('\n').split('\t', 3)
+                    self.entries[path] = (int(size), int(mtime), serialised)
+                    self._lines += 1
+
+    def _key(self, podcast_file: Path) -> str:
+        return str(podcast_file.relative_to(self.folder))
+
+    def load(self, podcast_file: Path) -> Episode:
+        """
+        Episode held by a library file, only reading its tags if the file changed since it was indexed
+        """
+        stat = podcast_file.stat()
+        entry = self.entries.get(self._key(podcast_file))
+        if entry and entry[:2] == (stat.st_size, stat.st_mtime_ns):
+            return Episode.deserialise(entry[2])
+        episode = Episode.load(podcast_file)
+        if episode:
+            self.update(podcast_file, episode, stat)
+        return episode
+
+    def update(self, podcast_file: Path, episode: Episode, stat: os.stat_result = None):
+        stat = stat or podcast_file.stat()
+        key = self._key(podcast_file)
+        entry = (stat.st_size, stat.st_mtime_ns, episode.serialise())
+        if self.entries.get(key) == entry:
+            return
+        self.entries[key] = entry
+        if self.read_only:
+            return
+        if not self._index:
+            self._index = self.index_path.open(mode='a')
+        self._index.write(self._line(key, entry))
+        self._index.flush()
+        self._lines += 1
+
+    def close(self):
+        if self._index:
+            self._index.close()
+            self._index = None
+        if not self.read_only and self._lines > 2 * len(self.entries):
+            self.save()
+
+    def save(self):
+        if self._index:
+            self._index.close()
+            self._index = None
+        temp_file = self.index_path.with_suffix('.tmp')
+        with temp_file.open(mode='w') as index:
+            for key in sorted(self.entries):
+                index.write(self._line(key, self.entries[key]))
+        temp_file.replace(self.index_path)
+        self._lines = len(self.entries)
+
+    @staticmethod
+    def _line(key: str, entry: Tuple[int, int, str]) -> str:
+        return F"{key}\t{entry[0]}\t{entry[1]}\t{entry[2]}\n"
+
+    def files(self) -> Iterator[Path]:
+        for root, folders, files in os.walk(self.folder):
+            folders[:] = sorted( folder for folder in folders if not folder.startswith('.') )
+            for name in sorted(files):
+                if os.path.splitext(name)[1] in self.EXTENSIONS:
+                    yield Path(root) / name
+
+    def rebuild(self, workers: int = 8) -> int:
+        """
+        Rescan the whole library, reading tags on a thread pool for files that are new or changed
+        """
+        found = {}
+        changed = []
+        for podcast_file in self.files():
+            stat = podcast_file.stat()
+            key = self._key(podcast_file)
+            found[key] = self.entries.get(key)
+            if not found[key] or found[key][:2] != (stat.st_size, stat.st_mtime_ns):
+                changed.append((podcast_file, stat))
+
+        def read(job: Tuple[Path, os.stat_result]) -> Tuple[Path, os.stat_result, Episode]:
+            podcast_file, stat = job
+            try:
+                return podcast_file, stat, Episode.load(podcast_file)
+            except:
+                logging.debug(traceback.format_exc())
+                return podcast_file, stat, None
+
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+            for podcast_file, stat, episode in pool.map(read, changed):
+                key = self._key(podcast_file)
+                if episode:
+                    found[key] = (stat.st_size, stat.st_mtime_ns, episode.serialise())
+                else:
+                    logging.warning(F"Unable to index {key}")
+                    del found[key]
+
+        self.entries = { key:entry for key, entry in found.items() if entry }
+        if not self.read_only:
+            self.save()
+        logging.info(F"Indexed {len(self.entries)} files, {len(changed)} read")
+        return len(changed)
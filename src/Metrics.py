@@ -0,0 +1,121 @@
+from collections import defaultdict
+from contextlib import contextmanager
+import json
+import os
+from pathlib import Path
+import threading
+import time
+from typing import Dict, Iterator, List, Tuple
+
+class Metrics:
+    """
+    Process wide counters and stage timings, written to the destination folder as JSON and as a Prometheus textfile
+    """
+
+    PREFIX: str = 'ichapod'
+    JSON_FILE: str = '.metrics.json'
+    PROMETHEUS_FILE: str = '.metrics.prom'
+
+    DESCRIPTIONS: Dict[str, str] = {
+        'feeds': 'Feeds requested, by HTTP status or error, or skipped while backing off',
+        'episodes_skipped': 'Episodes not downloaded, by what recognised them',
+        'episodes_downloaded': 'Episodes downloaded and tagged',
+        'episodes_failed': 'Episodes dropped, by the stage that failed',
+        'episodes_stored': 'Episodes moved into the destination folder',
+        'episodes_duplicated': 'Episodes copied or linked from an identical enclosure already in the library',
+        'download_bytes': 'Bytes of episodes received, by host',
+        'stage_seconds': 'Seconds spent in each stage, summed across threads',
+        'stage_calls': 'Times each stage ran',
+        'host_seconds': 'Seconds spent fetching from each host, by stage',
+    }
+
+    _counters: Dict[Tuple[str, tuple], float] = defaultdict(float)
+    _lock = threading.Lock()
+
+    @classmethod
+    def count(cls, name: str, amount: float = 1, **labels: str):
+        key = (name, tuple(sorted(labels.items())))
+        with cls._lock:
+            cls._counters[key] += amount
+
+    @classmethod
+    @contextmanager
+    def timer(cls, stage: str, host: str = None) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            cls.count('stage_seconds', elapsed, stage=stage)
+            cls.count('stage_calls', stage=stage)
+            if host is not None:
+                cls.count('host_seconds', elapsed, stage=stage, host=host)
+
+    @classmethod
+    def reset(cls):
+        with cls._lock:
+            cls._counters.clear()
+
+    @classmethod
+    def snapshot(cls) -> Dict[str, List[dict]]:
+        with cls._lock:
+            counters = sorted(cls._counters.items())
+        metrics = defaultdict(list)
+        for (name, labels), value in counters:
+            metrics[name].append({ 'labels':dict(labels), 'value':value })
+        return dict(metrics)
+
+    @classmethod
+    def write(cls, folder: Path, started: float, exit_code: int, worker: str = None):
+        """
+        Replace the JSON summary and Prometheus textfile in folder with the counts so far, named for worker if it shares the folder
+        """
+        finished = time.time()
+        metrics = cls.snapshot()
+        summary = {
+            'started': started,
+            'finished': finished,
+            'duration': finished - started,
+            'exit_code': exit_code,
+            'metrics': metrics,
+        }
+        #the collector rejects the same series from two files, so tell the workers apart
+        common = { 'worker':worker } if worker else {}
+        if worker:
+            summary['worker'] = worker
+        lines = []
+        for name, value, description in [
+            ('run_started_timestamp_seconds', started, 'When the run started'),
+            ('run_duration_seconds', finished - started, 'How long the run took'),
+            ('run_exit_code', exit_code, 'Exit code of the run'),
+        ]:
+            lines += [ F"# HELP {cls.PREFIX}_{name} {description}", F"# TYPE {cls.PREFIX}_{name} gauge", F"{cls.PREFIX}_{name}{cls._labels(common)} {cls._number(value)}" ]
+        for name, samples in metrics.items():
+            metric = F"{cls.PREFIX}_{name}_total"
+            lines += [ F"# HELP {metric} {cls.DESCRIPTIONS.get(name, name)}", F"# TYPE {metric} counter" ]
+            lines += [ F"{metric}{cls._labels({ **sample['labels'], **common })} {cls._number(sample['value'])}" for sample in samples ]
+
+        json_file, prometheus_file = cls.JSON_FILE, cls.PROMETHEUS_FILE
+        if worker:
+            json_file = json_file.replace('.json', F".{worker}.json")
+            prometheus_file = prometheus_file.replace('.prom', F".{worker}.prom")
+        cls._replace(folder / json_file, json.dumps(summary, indent=1))
+        cls._replace(folder / prometheus_file, "\n".join(lines) + "\n")
+
+    @staticmethod
+    def _number(value: float) -> str:
+        return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+    @staticmethod
+    def _labels(labels: dict) -> str:
+        if not labels:
+            return ''
+        escaped = ( (key, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')) for key, value in labels.items() )
+        return "{" + ",".join( F"{key}=\"{value}\"" for key, value in escaped ) + "}"
+
+    @staticmethod
+    def _replace(path: Path, text: str):
+        # collectors may read at any moment, so never let them see a partial file
+        temp_file = path.with_name(path.name + '.tmp')
+        temp_file.write_text(text)
+        os.replace(temp_file, path)
@@ -1,11 +1,17 @@
 
+from collections import OrderedDict
+import itertools
 import logging
 import traceback
-from typing import Dict, Iterator, List
+from typing import Dict, Iterator, List, Tuple
 import urllib3
-import xmltodict
+from xml.etree import ElementTree
 
-from Episode import Episode, Image, Blank
+from CoverCache import CoverCache
+from Episode import Episode, Blank
+from FeedCache import FeedCache
+from Http import Http
+from Metrics import Metrics
 from util import *
 
 class Podcast:
@@ -14,6 +20,15 @@ class Podcast:
         self.url = url
         self.author = author
         self.series = series
+        self._episodes: List['Episode'] = []
+        self._cover_image = None
+        self._log = logging
+        self.not_modified = False
+        self.failure: str = None
+        self.unreachable = False
+        self._fetched: Tuple[Dict[str, str], List[dict]] = None
+        self._outstanding = 0
+        self._incomplete = False
 
     @classmethod
     def create(cls, input: str) -> 'Podcast':
@@ -30,52 +45,180 @@ class Podcast:
             return None
         return [ token.strip() for token in input.split("---") ]
 
+    def refresh(self, cache: FeedCache = None, record: 'Record' = None, stop_after_known: int = 0, covers: CoverCache = None) -> 'Podcast':
+        """
+        Fetch and parse the manifest and cover ahead of time; safe to run on a worker thread as logging is deferred to episodes()
+        """
+        self._log = DeferredLog()
+        self._cover_image = None
+        self.not_modified = False
+        self.failure = None
+        self.unreachable = False
+        self._fetched = None
+        #held open until update() has queued every episode
+        self._outstanding = 1
+        self._incomplete = False
+        episodes: List['Episode'] = []
+        try:
+            with Metrics.timer('feed', Http.host(self.url)):
+                for episode in self._stream_episodes(cache, record, stop_after_known, covers or CoverCache()):
+                    episodes.append(episode)
+        except (urllib3.exceptions.HTTPError, OSError):
+            Metrics.count('feeds', status='error')
+            self.failure = 'unreachable'
+            self.unreachable = True
+            self._log.error(F"Failed to refresh {self.url}")
+            self._log.debug(traceback.format_exc())
+            set_error(1)
+        except:
+            #a fault of the feed or of ichapod, not of its host
+            Metrics.count('feeds', status='error')
+            self.failure = 'error'
+            self._log.error(F"Failed to refresh {self.url}")
+            self._log.debug(traceback.format_exc())
+            set_error(1)
+        for episode in episodes:
+            if episode.cover_image is None:
+                episode.cover_image = self._cover_image
+        self._episodes = episodes
+        return self
+
     def episodes(self) -> Iterator['Episode']:
-        manifest = self._get_manifest()
-        cover_image = self._download_cover(manifest)
-        return self._episodes(manifest, cover_image)
-
-    def _episodes(self, manifest: dict, cover_image: Image) -> Iterator['Episode']:
-        author: str = self.author if self.author else dict['rss']['channel']['title']
-        album: str = self.series if self.series else author
-
-        episodes: List(dict) = manifest['rss']['channel']['item']
-
-        for episode_blob in episodes :
-            episode = Episode.create(author, album, episode_blob, cover_image)
-            if episode and not isinstance(episode, Blank):
-                yield episode
-            elif not episode:
-                logging.warning(F"Something was wrong with {author} - {album} - {episode_blob['title']}")
-            continue
-
-    def _download_cover(self, manifest: dict) -> Image:
-        if 'image' in manifest['rss']['channel']:
-            try:
-                image_url = manifest['rss']['channel']['image']['url']
-
-                with urllib3.PoolManager() as http:
-                    response = http.request('GET', image_url, preload_content=False)
-                    image_data: bytes = response.data
-                    image_type: str = response.headers['Content-Type']
-                return Image(data=image_data, type=image_type)
-            except:
-                logging.warning(F"Failed to retrieve cover image for {str(self)}")
-                logging.debug(traceback.format_exc())
+        if not isinstance(self._log, DeferredLog):
+            self.refresh()
+        self._log.replay()
+        self._log = logging
+        episodes, self._episodes = self._episodes, []
+        return iter(episodes)
+
+    def expect(self):
+        """
+        Count an episode of this feed queued for the library
+        """
+        self._outstanding += 1
+
+    def settle(self, cache: FeedCache, failed: bool = False):
+        """
+        Count off a queued episode and, once none remain, save the feed with its validators unless any failed
+        """
+        self._incomplete = self._incomplete or failed
+        self._outstanding -= 1
+        if self._outstanding > 0 or not self._fetched:
+            return
+        headers, items = self._fetched
+        self._fetched = None
+        if cache:
+            cache.store(self.url, {} if self._incomplete else headers, items)
+
+    def _stream_episodes(self, cache: FeedCache = None, record: 'Record' = None, stop_after_known: int = 0, covers: CoverCache = None) -> Iterator['Episode']:
+        """
+        Yield episodes as the feed arrives, giving up once stop_after_known consecutive episodes are already in the record
+        """
+        headers = urllib3.make_headers(accept_encoding=True)
+        if cache:
+            headers.update(cache.validators(self.url))
+        response = Http.request('GET', self.url, headers=headers, preload_content=False)
+        Metrics.count('feeds', status=str(response.status))
+        try:
+            if response.status == 304:
+                self._log.info(F"No changes to {self}")
+                self.not_modified = True
+                return
+            if response.status >= 400:
+                self.failure = F"HTTP {response.status}"
+                self.unreachable = response.status >= 500
+                self._log.error(F"Failed to fetch {self.url}: HTTP {response.status}")
                 set_error(1)
-        return None
+                return
 
-    def _get_manifest(self) -> Dict:
-        with urllib3.PoolManager() as http:
-            response = http.request('GET', self.url, preload_content=False)
+            title: str = None
+            items: List[dict] = []
+            known = 0
             try:
-                data: dict = xmltodict.parse(response.data)
-            except:
-                logging.error(F"Failed to parse xml from {url}")
-                logging.debug(traceback.format_exc())
+                for kind, value in self._stream_items(response.stream(64 * 1024)):
+                    if kind == 'title':
+                        title = value
+                    elif kind == 'image':
+                        self._cover_image = covers.image(value) if covers else None
+                    elif kind == 'item':
+                        items.append(FeedCache.compact(value))
+                        author: str = self.author if self.author else title
+                        album: str = self.series if self.series else author
+                        try:
+                            episode = Episode.create(author, album, value, self._cover_image, log=self._log)
+                        except Exception:
+                            #one malformed item should not cost the rest of the feed
+                            self._log.debug(traceback.format_exc())
+                            episode = None
+                        if episode and not isinstance(episode, Blank):
+                            yield episode
+                            known = known + 1 if record and record.check(episode) else 0
+                            if stop_after_known and known >= stop_after_known:
+                                self._log.debug(F"Stopped reading {self.url} after {known} known episodes")
+                                break
+                        elif not episode:
+                            self._log.warning(F"Something was wrong with {author} - {album} - {value.get('title')}")
+            except ElementTree.ParseError:
+                self.failure = 'unparseable'
+                self._log.error(F"Failed to parse xml from {self.url}")
+                self._log.debug(traceback.format_exc())
                 set_error(1)
+                return
+
+            #only saved by settle() once the episodes are in, so a run that stops part way sees the whole feed again
+            self._fetched = (response.headers, items)
+        finally:
+            response.close()
+            response.release_conn()
 
-        return data
+    @classmethod
+    def _stream_items(cls, chunks: Iterator[bytes]) -> Iterator[Tuple[str, object]]:
+        """
+        Incrementally parse an RSS document, yielding the channel title, the cover url and each item as it completes
+        """
+        parser = ElementTree.XMLPullParser(events=('start', 'end'))
+        path: List[str] = []
+        channel: ElementTree.Element = None
+        for chunk in itertools.chain(chunks, [None]):
+            if chunk is None:
+                parser.close()
+            else:
+                parser.feed(chunk)
+            for event, element in parser.read_events():
+                if event == 'start':
+                    path.append(element.tag)
+                    if path == ['rss', 'channel']:
+                        channel = element
+                    continue
+                if path == ['rss', 'channel', 'item']:
+                    yield 'item', cls._element_value(element)
+                    channel.remove(element)
+                elif path == ['rss', 'channel', 'title']:
+                    yield 'title', element.text.strip() if element.text else None
+                elif path == ['rss', 'channel', 'image', 'url']:
+                    yield 'image', element.text.strip() if element.text else None
+                path.pop()
+
+    @classmethod
+    def _element_value(cls, element: ElementTree.Element):
+        """
+        Convert an element to the same shape xmltodict produces
+        """
+        text = element.text.strip() if element.text and element.text.strip() else None
+        if not element.attrib and not len(element):
+            return text
+        value = OrderedDict(( F"@{key}", attribute ) for key, attribute in element.attrib.items())
+        for child in element:
+            child_value = cls._element_value(child)
+            if child.tag not in value:
+                value[child.tag] = child_value
+            elif isinstance(value[child.tag], list):
+                value[child.tag].append(child_value)
+            else:
+                value[child.tag] = [value[child.tag], child_value]
+        if text:
+            value['#text'] = text
+        return value
 
     def _folder(self):
         if self.series and self.series != self.author:
@@ -1,29 +1,192 @@
-
+import heapq
 from pathlib import Path
 import logging
+import mmap
+import os
+import time
+from typing import Iterator, List
 
 from Episode import Episode
+from Leases import Leases
 
 class Record:
+    """
+    Sorted snapshot of downloaded episodes, with new entries appended to a journal as they are stored and merged in by compact()
+
+    Workers sharing the snapshot each journal to their own segment, closed at the end of their run, and only the worker holding
+    the lease on the snapshot merges the closed segments in
+    """
 
-    def __init__(self, file_path: Path):
+    def __init__(self, file_path: Path, read_only: bool = False, compact_every: int = 1000, mapped: bool = False, segment: str = None, leases: Leases = None):
         self.file_path = file_path
-        self.entries = []
+        self.segment = segment
+        self.journal_path = file_path.with_name(F"{file_path.name}.{segment}.journal") if segment else file_path.with_suffix('.journal')
+        self.leases = leases
+        self.read_only = read_only
+        self.compact_every = compact_every
+        self.mapped = mapped
         self.new_entries = []
-        if self.file_path.exists():
-            with self.file_path.open(mode='r') as record:
-                self.entries += [line.rstrip('\n') for line in record]
+        self.index = set()
+        self._journal = None
+        self._map: mmap.mmap = None
+        if self.mapped:
+            self._map_snapshot()
+        else:
+            #only the identities are kept, check() never needs the lines themselves
+            self.index.update(Episode.identity_of(line) for line in self._snapshot_lines())
+        self.new_entries += self._read_journal()
+        for path in self._segments(closed_only=False):
+            self.new_entries += self._read_segment(path)
+        self.index.update(Episode.identity_of(line) for line in self.new_entries)
+
+    def _read_journal(self) -> List[str]:
+        if not self.journal_path.exists():
+            return []
+        data = self.journal_path.read_text()
+        complete = data[:data.rfind('\n')+1]
+        if complete != data and not self.read_only:
+            logging.warning(F"Dropping incomplete entry from {self.journal_path}")
+            with self.journal_path.open(mode='r+') as journal:
+                journal.truncate(len(complete.encode('utf-8')))
+        return [ line for line in complete.split('\n') if line ]
+
+    def _segments(self, closed_only: bool = True) -> List[Path]:
+        """
+        Journals other than this record's own, those of workers still running only if closed_only is False
+        """
+        closed = sorted(self.file_path.parent.glob(F"{self.file_path.name}.*.segment"))
+        if closed_only:
+            return closed
+        journals = [self.file_path.with_suffix('.journal')] + sorted(self.file_path.parent.glob(F"{self.file_path.name}.*.journal"))
+        return closed + [ path for path in journals if path != self.journal_path and path.exists() ]
+
+    @staticmethod
+    def _read_segment(path: Path) -> List[str]:
+        try:
+            data = path.read_text()
+        except FileNotFoundError:
+            return []
+        #another worker may be part way through writing the last line
+        return [ line for line in data[:data.rfind('\n')+1].split('\n') if line ]
 
     def store(self, episode: Episode):
-        self.new_entries.append(episode.serialise())
+        line = episode.serialise()
+        self.new_entries.append(line)
+        self.index.add(episode.identity())
+        if self.read_only:
+            return
+        if not self._journal:
+            self._journal = self.journal_path.open(mode='a')
+        self._journal.write(line+'\n')
+        self._journal.flush()
+        os.fsync(self._journal.fileno())
 
     def check(self, episode: Episode) -> bool:
-        return episode.lookup(self.entries)
+        if episode.identity() in self.index:
+            return True
+        if not self._map:
+            return False
+        prefix = "\t".join([episode.author, episode.album, episode.date, '']).encode('utf-8')
+        guid = episode.guid.encode('utf-8')
+        return any( line.split(b'\t', 6)[5] == guid for line in self._mapped_lines(prefix) )
+
+    def _map_snapshot(self):
+        if self._map:
+            self._map.close()
+            self._map = None
+        if self.file_path.exists() and self.file_path.stat().st_size:
+            with self.file_path.open(mode='rb') as record:
+                self._map = mmap.mmap(record.fileno(), 0, access=mmap.ACCESS_READ)
 
-    def sort(self):
-        entries = set(self.entries + self.new_entries)
-        temp_file = self.file_path.with_suffix('.tmp')
+    def _mapped_lines(self, prefix: bytes) -> Iterator[bytes]:
+        """
+        Binary search the mapped snapshot for the first line starting with prefix, then yield each line that does
+        """
+        data = self._map
+        lo, hi = 0, len(data)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            start = data.rfind(b'\n', 0, mid) + 1
+            end = data.find(b'\n', start)
+            end = len(data) if end < 0 else end
+            if data[start:start+len(prefix)] < prefix:
+                lo = end + 1
+            else:
+                hi = start
+        while lo < len(data):
+            end = data.find(b'\n', lo)
+            end = len(data) if end < 0 else end
+            line = data[lo:end]
+            if not line.startswith(prefix):
+                break
+            yield line
+            lo = end + 1
+
+    def close(self) -> bool:
+        """
+        Checkpoint the record and release the mapped snapshot, after which check() only sees entries held in memory
+        """
+        compacted = self.checkpoint()
+        if self._map:
+            self._map.close()
+            self._map = None
+        return compacted
+
+    def checkpoint(self) -> bool:
+        """
+        Close the journal, compacting it into the snapshot once it holds compact_every entries, keeping the record usable
+        """
+        if self._journal:
+            self._journal.close()
+            self._journal = None
+        if self.segment and not self.read_only and self.journal_path.exists():
+            #a closed segment is never written again, so any worker may merge it
+            self.journal_path.rename(self.file_path.with_name(F"{self.file_path.name}.{self.segment}.{time.time_ns()}.segment"))
+        compacted = False
+        if not self.read_only and self.new_entries and len(self.new_entries) >= self.compact_every:
+            if not self.leases:
+                self.compact()
+                compacted = True
+            elif self.leases.claim(str(self.file_path)):
+                try:
+                    self.compact()
+                    compacted = True
+                finally:
+                    self.leases.release(str(self.file_path))
+        return compacted
+
+    def compact(self):
+        """
+        Merge the journal and any closed segments into the sorted snapshot and start a fresh journal
+        """
+        if self._journal:
+            self._journal.close()
+            self._journal = None
+        segments = self._segments()
+        new_entries = set(self.new_entries)
+        for path in segments:
+            new_entries.update(self._read_segment(path))
+        temp_file = self.file_path.with_name(F"{self.file_path.name}.{self.segment}.tmp") if self.segment else self.file_path.with_suffix('.tmp')
         with temp_file.open(mode='w+') as record:
-            for line in sorted(entries):
-                record.write(line+'\n')
+            previous = None
+            for line in heapq.merge(self._snapshot_lines(), sorted(new_entries)):
+                if line != previous:
+                    record.write(line+'\n')
+                previous = line
+            record.flush()
+            os.fsync(record.fileno())
         temp_file.replace(self.file_path)
+        for path in [self.journal_path] + segments:
+            if path.exists():
+                path.unlink()
+        self.new_entries = []
+        if self.mapped:
+            self._map_snapshot()
+
+    def _snapshot_lines(self) -> Iterator[str]:
+        if self.file_path.exists():
+            with self.file_path.open(mode='r') as record:
+                for line in record:
+                    line = line.rstrip('\n')
+                    if line:
+                        yield line
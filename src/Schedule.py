@@ -0,0 +1,72 @@
+from datetime import datetime
+import hashlib
+import logging
+import statistics
+from typing import Dict, List, Tuple
+
+from Podcast import Podcast
+from util import *
+
+class Schedule:
+    """
+    Decides when each podcast is next refreshed from how often its feed has published
+    """
+
+    HISTORY: int = 10
+
+    def __init__(self, min_interval: float = 3600, max_interval: float = 7 * 86400):
+        self.min_interval = min_interval
+        self.max_interval = max(min_interval, max_interval)
+        self.entries: Dict[str, Tuple[Podcast, float, float]] = {}
+
+    def track(self, podcasts: List[Podcast], items: Dict[str, List[dict]], now: float):
+        """
+        Follow a new podcast list, keeping the timings of podcasts already scheduled
+        """
+        entries = {}
+        for podcast in podcasts:
+            if podcast.url in self.entries:
+                entries[podcast.url] = (podcast, *self.entries[podcast.url][1:])
+            elif items.get(podcast.url):
+                # spread known feeds across their interval rather than polling them all at once
+                interval = self.interval(items[podcast.url], now)
+                entries[podcast.url] = (podcast, now + self._offset(podcast.url) * interval, interval)
+            else:
+                entries[podcast.url] = (podcast, now, self.min_interval)
+        self.entries = entries
+
+    def due(self, now: float) -> List[Podcast]:
+        return [ podcast for podcast, next_due, interval in self.entries.values() if next_due <= now ]
+
+    def polled(self, podcast: Podcast, items: List[dict], now: float):
+        interval = self.interval(items, now)
+        self.entries[podcast.url] = (podcast, now + interval, interval)
+        logging.debug(F"Next refresh of {podcast} in {interval/3600:.1f} hours")
+
+    def wait(self, now: float) -> float:
+        if not self.entries:
+            return self.max_interval
+        return max(0, min( next_due for podcast, next_due, interval in self.entries.values() ) - now)
+
+    def interval(self, items: List[dict], now: float) -> float:
+        """
+        Poll about 24 times per typical gap between episodes, backing off for feeds that have gone quiet
+        """
+        dates = sorted(( date for date in map(self._timestamp, items) if date ), reverse=True)[:self.HISTORY]
+        if len(dates) < 2:
+            return self.min_interval
+        gap = statistics.median( newer - older for newer, older in zip(dates, dates[1:]) )
+        quiet = now - dates[0]
+        interval = max(gap, quiet) / 24
+        return min(self.max_interval, max(self.min_interval, interval))
+
+    @staticmethod
+    def _timestamp(item: dict) -> float:
+        try:
+            return datetime.strptime(convert_date(item['pubDate']), "%Y-%m-%d-%H%M").timestamp()
+        except:
+            return None
+
+    @staticmethod
+    def _offset(url: str) -> float:
+        return int(hashlib.sha1(url.encode('utf-8')).hexdigest()[:8], 16) / 2**32
@@ -0,0 +1,236 @@
+#!/usr/bin/env python3
+"""
+Run the whole Ichapod pipeline against a local server of synthetic feeds, cover art and enclosures, reporting the metrics of cold, warm and no-op runs
+"""
+
+import argparse
+from collections import defaultdict
+import functools
+import hashlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import os
+from pathlib import Path
+import shutil
+import struct
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from typing import List
+
+SOURCE = Path(__file__).resolve().parent
+
+LOG_CONFIG = """
+[loggers]
+keys=root
+
+[handlers]
+keys=file
+
+[formatters]
+keys=simple
+
+[logger_root]
+level=NOTSET
+handlers=file
+
+[handler_file]
+class=FileHandler
+level=NOTSET
+formatter=simple
+args=({log!r},)
+
+[formatter_simple]
+format=%(levelname)-8s%(message)s
+class=logging.Formatter
+"""
+
+def mp3(size: int) -> bytes:
+    frame = bytes([0xFF, 0xFB, 0x90, 0x64]) + bytes(413)
+    return frame * max(1, size // len(frame))
+
+def m4a(size: int) -> bytes:
+    """
+    Smallest MP4 audio file mutagen will read and tag, padded out with an mdat
+    """
+    def atom(name: bytes, data: bytes = b'') -> bytes:
+        return struct.pack('>I4s', 8+len(data), name) + data
+    def full(name: bytes, data: bytes, flags: int = 0) -> bytes:
+        return atom(name, struct.pack('>I', flags) + data)
+    esds = full(b'esds', bytes([3,25,0,1,0, 4,17,0x40,0x15, 0,0,0, 0,1,0xf4,0, 0,1,0xf4,0, 5,2,0x12,0x10, 6,1,2]))
+    mp4a = atom(b'mp4a', bytes(6) + struct.pack('>H', 1) + bytes(8) + struct.pack('>HHHH', 2, 16, 0, 0) + struct.pack('>I', 44100<<16) + esds)
+    stbl = atom(b'stbl', full(b'stsd', struct.pack('>I', 1) + mp4a) + full(b'stts', struct.pack('>I', 0)) + full(b'stsc', struct.pack('>I', 0))
+        + full(b'stsz', struct.pack('>II', 0, 0)) + full(b'stco', struct.pack('>I', 0)))
+    mdia = atom(b'mdia', full(b'mdhd', struct.pack('>IIII', 0, 0, 44100, 44100) + b'\x55\xc4\x00\x00')
+        + full(b'hdlr', bytes(4) + b'soun' + bytes(13)) + atom(b'minf', full(b'smhd', bytes(4)) + stbl))
+    trak = atom(b'trak', full(b'tkhd', struct.pack('>IIIII', 0, 0, 1, 0, 1000) + bytes(60), flags=3) + mdia)
+    mvhd = full(b'mvhd', struct.pack('>IIII', 0, 0, 1000, 1000) + b'\x00\x01\x00\x00\x01\x00' + bytes(70) + struct.pack('>I', 2))
+    head = atom(b'ftyp', b'M4A \x00\x00\x00\x00M4A mp42isom') + atom(b'moov', mvhd + trak)
+    return head + atom(b'mdat', bytes(max(0, size - len(head) - 8)))
+
+class Catalogue:
+    """
+    Synthetic feeds, each publishing one item a day, newest first, with enclosures alternating between MP3 and M4A by feed
+    """
+
+    def __init__(self, sizes: List[int], enclosure_size: int):
+        self.items = dict(enumerate(sizes))
+        self.media = { 'mp3':mp3(enclosure_size), 'm4a':m4a(enclosure_size) }
+        self.cover = b'\x89PNG\r\n\x1a\n' + bytes(2048)
+        self.host: str = None
+
+    def publish(self, count: int):
+        for feed in self.items:
+            self.items[feed] += count
+
+    def extension(self, feed: int) -> str:
+        return 'm4a' if feed % 2 else 'mp3'
+
+    def enclosure(self, feed: int, n: int) -> bytes:
+        """
+        Media of one item, ending in its feed and number so no two enclosures share content and none is taken for a duplicate
+        """
+        media = self.media[self.extension(feed)]
+        tag = F"{feed}/{n}".encode('utf-8')
+        return media[:-len(tag)] + tag
+
+    @functools.lru_cache(maxsize=None)
+    def feed(self, feed: int, count: int) -> bytes:
+        extension = self.extension(feed)
+        mimetype = 'audio/mp4' if extension == 'm4a' else 'audio/mpeg'
+        items = []
+        for n in reversed(range(count)):
+            published = time.strftime('%a, %d %b %Y %H:%M:%S +0000', time.gmtime(1420070400 + n * 86400))
+            items.append(F"<item><title>Episode {n} - part {n % 7}</title><pubDate>{published}</pubDate><guid>feed-{feed}-{n}</guid>"
+                F"<enclosure url=\"{self.host}/media/{feed}/{n}.{extension}\" type=\"{mimetype}\" length=\"{len(self.media[extension])}\"/></item>")
+        return (F"<?xml version=\"1.0\"?><rss version=\"2.0\"><channel><title>Show {feed}</title>"
+            F"<image><url>{self.host}/cover.png</url></image>{''.join(items)}</channel></rss>").encode('utf-8')
+
+    def podcast_list(self) -> str:
+        return "".join( F"Author {feed}---Show {feed}---{self.host}/feed/{feed}.xml\n" for feed in self.items )
+
+class Traffic:
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.requests = defaultdict(int)
+            self.bytes = 0
+
+    def count(self, kind: str, sent: int):
+        with self._lock:
+            self.requests[kind] += 1
+            self.bytes += sent
+
+def handler(catalogue: Catalogue, traffic: Traffic):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def do_GET(self):
+            parts = self.path.strip('/').split('/')
+            if parts[0] == 'feed':
+                feed = int(parts[1].split('.')[0])
+                self.send(parts[0], catalogue.feed(feed, catalogue.items[feed]), 'application/rss+xml')
+            elif parts[0] == 'cover.png':
+                self.send('cover', catalogue.cover, 'image/png')
+            elif parts[0] == 'media':
+                feed, extension = int(parts[1]), parts[2].split('.')[-1]
+                self.send(parts[0], catalogue.enclosure(feed, int(parts[2].split('.')[0])), 'audio/mp4' if extension == 'm4a' else 'audio/mpeg')
+            else:
+                self.send_error(404)
+
+        def send(self, kind: str, body: bytes, mimetype: str):
+            etag = F"\"{hashlib.sha1(body).hexdigest()}\""
+            if self.headers.get('If-None-Match') == etag:
+                self.send_response(304)
+                self.send_header('ETag', etag)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                traffic.count(kind, 0)
+                return
+            self.send_response(200)
+            self.send_header('Content-Type', mimetype)
+            self.send_header('Content-Length', str(len(body)))
+            self.send_header('ETag', etag)
+            self.end_headers()
+            self.wfile.write(body)
+            traffic.count(kind, len(body))
+
+        def log_message(self, *args):
+            pass
+
+    return Handler
+
+class Server(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # clients drop kept alive connections when they exit
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+def run(label: str, work: Path, catalogue: Catalogue, traffic: Traffic, ichapod_args: List[str]):
+    destination = work / 'podcasts'
+    traffic.reset()
+    command = [ sys.executable, str(SOURCE / 'Ichapod.py'), str(work / 'podcasts.txt'), str(destination),
+        '--temp_download_location', str(work / 'temp'), '--log-config', str(work / 'log.conf') ] + ichapod_args
+    start = time.perf_counter()
+    process = subprocess.Popen(command)
+    _, status, usage = os.wait4(process.pid, 0)
+    wall = time.perf_counter() - start
+    process.returncode = os.waitstatus_to_exitcode(status)
+
+    stored = sum( 1 for path in destination.rglob('*') if path.suffix in ['.mp3', '.m4a'] )
+    print(F"\n{label}")
+    print(F"  {'wall':<16}{wall:10.3f}s")
+    print(F"  {'exit code':<16}{process.returncode:10}")
+    print(F"  {'peak rss':<16}{usage.ru_maxrss / 1024:10.1f}MB")
+    print(F"  {'served':<16}{traffic.bytes / 1024 / 1024:10.2f}MB  " + ", ".join( F"{count} {kind}" for kind, count in sorted(traffic.requests.items()) ))
+    print(F"  {'episodes stored':<16}{stored:10}")
+
+    metrics = json.loads((destination / '.metrics.json').read_text())['metrics']
+    calls = { sample['labels']['stage']:sample['value'] for sample in metrics.get('stage_calls', []) }
+    for sample in metrics.get('stage_seconds', []):
+        stage = sample['labels']['stage']
+        print(F"  {stage:<16}{sample['value']:10.3f}s over {calls[stage]:.0f} calls")
+    for name in ['feeds', 'episodes_skipped', 'episodes_failed']:
+        for sample in metrics.get(name, []):
+            print(F"  {name + ' ' + ' '.join(sample['labels'].values()):<32}{sample['value']:.0f}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Benchmark the Ichapod pipeline end to end.')
+    parser.add_argument('--items', type=lambda value: [ int(size) for size in value.split(',') ], default=[10, 100, 1000], help='Comma separated item counts, one feed each')
+    parser.add_argument('--new-items', type=int, default=5, help='Items each feed publishes before the warm run')
+    parser.add_argument('--enclosure-size', type=int, default=16384, help='Bytes in each enclosure')
+    parser.add_argument('--keep', type=Path, default=None, help='Work in this folder and keep it, instead of a temporary one')
+    parser.add_argument('ichapod_args', nargs=argparse.REMAINDER, help='Further arguments passed to Ichapod.py after a --')
+    args = parser.parse_args()
+    ichapod_args = args.ichapod_args[1:] if args.ichapod_args[:1] == ['--'] else args.ichapod_args
+
+    if not shutil.which('ffmpeg'):
+        print("ffmpeg is not on the PATH, so replay gain fails and no episode will be stored")
+
+    catalogue = Catalogue(args.items, args.enclosure_size)
+    traffic = Traffic()
+    server = Server(('127.0.0.1', 0), handler(catalogue, traffic))
+    catalogue.host = F"http://127.0.0.1:{server.server_port}"
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    with tempfile.TemporaryDirectory() as folder:
+        work = args.keep or Path(folder)
+        work.mkdir(parents=True, exist_ok=True)
+        (work / 'podcasts.txt').write_text(catalogue.podcast_list())
+        (work / 'log.conf').write_text(LOG_CONFIG.format(log=str(work / 'ichapod.log')))
+
+        print(F"{len(args.items)} feeds of {', '.join(map(str, args.items))} items, {args.enclosure_size} byte enclosures")
+        run("cold: empty destination", work, catalogue, traffic, ichapod_args)
+        catalogue.publish(args.new_items)
+        run(F"warm: {args.new_items} new items per feed", work, catalogue, traffic, ichapod_args)
+        run("no-op: nothing changed", work, catalogue, traffic, ichapod_args)
+
+    server.shutdown()
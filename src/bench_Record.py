@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+"""
+Compare download record lookups by bisecting the sorted entries, the identity index and the memory-mapped snapshot, on a synthetic record
+"""
+
+import argparse
+from pathlib import Path
+import random
+import tempfile
+import time
+
+from Episode import Episode
+from Record import Record
+
+def synthetic_episode(n: int) -> Episode:
+    author = F"Author {n % 700:03}"
+    album = F"Album {n % 13:02}"
+    date = F"{2000 + n % 20}-{1 + n % 12:02}-{1 + n % 28:02}-{n % 24:02}{n % 60:02}"
+    return Episode(F"http://example.com/{n}.mp3", n % 7000, F"Episode {n}", author, album, date, ".mp3", F"guid-{n}")
+
+def write_record(path: Path, size: int):
+    with path.open(mode='w') as record:
+        for line in sorted(synthetic_episode(n).serialise() for n in range(size)):
+            record.write(line+'\n')
+
+def timed(label: str, function, repeat: int = 1):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        result = function()
+    elapsed = time.perf_counter() - start
+    print(F"{label:<32}{elapsed:10.4f}s")
+    return result
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Benchmark download record lookups.')
+    parser.add_argument('--size', type=int, default=500000, help='Lines in the synthetic record')
+    parser.add_argument('--lookups', type=int, default=10000, help='Episodes to check')
+    args = parser.parse_args()
+
+    random.seed(0)
+    with tempfile.TemporaryDirectory() as folder:
+        path = Path(folder) / '.download_record'
+        timed(F"write {args.size} lines", lambda: write_record(path, args.size))
+        record = timed("load record", lambda: Record(path))
+
+        known = [ synthetic_episode(random.randrange(args.size)) for _ in range(args.lookups // 2) ]
+        unknown = [ synthetic_episode(args.size + n) for n in range(args.lookups - len(known)) ]
+        episodes = known + unknown
+        random.shuffle(episodes)
+
+        #the record keeps only identities, so bisect over a list of the lines loaded here
+        entries = timed("load sorted lines", lambda: path.read_text().splitlines())
+        bisect_hits = timed(F"bisect lookup x{len(episodes)}", lambda: sum(episode.lookup(entries) for episode in episodes))
+        index_hits = timed(F"index lookup x{len(episodes)}", lambda: sum(record.check(episode) for episode in episodes))
+        mapped = timed("load mapped record", lambda: Record(path, mapped=True))
+        mapped_hits = timed(F"mapped lookup x{len(episodes)}", lambda: sum(mapped.check(episode) for episode in episodes))
+        mapped.close()
+        assert bisect_hits == index_hits == mapped_hits == len(known), (bisect_hits, index_hits, mapped_hits, len(known))
@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+"""
+Compare the date normaliser against parsing every date with dateutil, over a feed's worth of pubDate values in the forms feeds publish
+"""
+
+import argparse
+import random
+import re
+import time
+import warnings
+
+from dateutil import parser as dateutil_parser
+
+import util
+
+FORMS = [
+    "{weekday}, {day:02} {month} {year} {hour:02}:{minute:02}:{second:02} +0000",
+    "{weekday}, {day:02} {month} {year} {hour:02}:{minute:02}:{second:02} GMT",
+    "{weekday}, {day} {month} {year} {hour:02}:{minute:02}:{second:02} -0500",
+    "{weekday}, {day:02} {month} {year} {hour:02}:{minute:02}:{second:02} EDT",
+    "{weekday}, {day:02} {month} {year} {hour:02}:{minute:02} PST",
+    "{year}-{month_number:02}-{day:02}T{hour:02}:{minute:02}:{second:02}Z",
+]
+
+def feed_dates(items: int, feeds: int) -> list:
+    """
+    Dates of items in feeds of items each, every feed using one form and one publishing hour
+    """
+    dates = []
+    for feed in range(feeds):
+        form = FORMS[feed % len(FORMS)]
+        hour = random.randrange(24)
+        for n in range(items):
+            day = 1 + n % 28
+            month_number = 1 + (n // 28) % 12
+            dates.append(form.format(weekday='Mon', day=day, month=['Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec'][month_number-1],
+                month_number=month_number, year=2019 - n // 336, hour=hour, minute=0, second=0))
+    return dates
+
+def dateutil_convert(date: str) -> str:
+    loading_date = re.match(r'^(?P<date>\d{4}-\d{2}-\d{2}).(?P<time>\d{0,3})$', date)
+    if loading_date:
+        date = F"{loading_date.group('date')} {int(loading_date.group('time')):04}"
+    return dateutil_parser.parse(date, tzinfos=util._tzinfos()).strftime("%Y-%m-%d-%H%M")
+
+def dateutil_tracknumber(date: str) -> str:
+    return str((dateutil_parser.parse(date) - dateutil_parser.parse('2000-09-01')).days)
+
+def timed(label: str, function, repeat: int = 1):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        result = function()
+    elapsed = time.perf_counter() - start
+    print(F"{label:<32}{elapsed:10.4f}s")
+    return result
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Benchmark date normalisation.')
+    parser.add_argument('--items', type=int, default=3000, help='Items in each feed')
+    parser.add_argument('--feeds', type=int, default=6, help='Feeds parsed')
+    parser.add_argument('--runs', type=int, default=3, help='Times every feed is parsed, as repeated runs of a daemon would')
+    args = parser.parse_args()
+
+    random.seed(0)
+    warnings.simplefilter('ignore')
+    dates = feed_dates(args.items, args.feeds)
+
+    expected = timed(F"dateutil x{len(dates)} x{args.runs}", lambda: [ dateutil_tracknumber(dateutil_convert(date)) for date in dates ], args.runs)
+    util.convert_date.cache_clear()
+    util.tracknumber_from_date.cache_clear()
+    fast = timed(F"normaliser first run x{len(dates)}", lambda: [ util.tracknumber_from_date(util.convert_date(date)) for date in dates ])
+    timed(F"normaliser later runs x{args.runs - 1}", lambda: [ util.tracknumber_from_date(util.convert_date(date)) for date in dates ], max(1, args.runs - 1))
+    assert fast == expected
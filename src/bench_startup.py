@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+"""
+Time how long Ichapod takes to start, both importing the module and running against an empty podcast list, and list the heavy dependencies each loads
+"""
+
+import argparse
+from pathlib import Path
+import subprocess
+import sys
+import tempfile
+import time
+
+HEAVY = ['mutagen', 'r128gain', 'dateutil', 'pytz', 'urllib3']
+
+LOG_CONFIG = """
+[loggers]
+keys=root
+
+[handlers]
+keys=null
+
+[formatters]
+keys=
+
+[logger_root]
+level=INFO
+handlers=null
+
+[handler_null]
+class=NullHandler
+args=()
+"""
+
+SOURCE = Path(__file__).resolve().parent
+
+def timed(label: str, command: list, repeat: int):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run(command, check=True, cwd=SOURCE)
+        times.append(time.perf_counter() - start)
+    print(F"{label:<32}{min(times):10.4f}s min{sum(times)/len(times):10.4f}s mean")
+
+def loaded(statement: str) -> list:
+    check = F"import sys\n{statement}\nprint(' '.join(m for m in {HEAVY!r} if m in sys.modules))"
+    return subprocess.run([sys.executable, '-c', check], check=True, cwd=SOURCE, capture_output=True, text=True).stdout.split()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Benchmark Ichapod start up.')
+    parser.add_argument('--repeat', type=int, default=10, help='Runs of each command')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as folder:
+        folder = Path(folder)
+        (folder / 'log.conf').write_text(LOG_CONFIG)
+        (folder / 'podcasts.txt').write_text('')
+        run = [ sys.executable, str(SOURCE / 'Ichapod.py'), str(folder / 'podcasts.txt'), str(folder / 'podcasts'),
+            '--temp_download_location', str(folder / 'temp'), '--log-config', str(folder / 'log.conf') ]
+
+        timed("interpreter", [sys.executable, '-c', 'pass'], args.repeat)
+        timed("import Ichapod", [sys.executable, '-c', 'import Ichapod'], args.repeat)
+        timed("no-op run", run, args.repeat)
+        print(F"{'loaded by import':<32}{' '.join(loaded('import Ichapod')) or '-'}")
+        print(F"{'loaded by no-op run':<32}{' '.join(loaded(F'import Ichapod; Ichapod.main({run[2:]!r})')) or '-'}")
@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+"""
+Compare the memoised text clean up against the original per call version, over the strings a run cleans for every item of a feed
+"""
+
+import argparse
+import re
+import time
+
+import util
+from util import __ok_unicode as ok_unicode
+
+UNICODE_MAP = {
+    ord(u'\xa0'):' ', ord(u'\u0009'):' ', ord(u'​'):'', ord(u'–'):'-', ord(u'—'):'-',
+    ord(u'‘'):'\'', ord(u'’'):'\'', ord(u'′'):'\'', ord(u'“'):'\"', ord(u'”'):'\"',
+}
+VALID_PATH_MAP = { ord(':'):', ', ord('/'):', ', ord('?'):None }
+
+def original_squelch_whitespace(string: str) -> str:
+    return re.sub(r'\s*(?P<chr>[ ,])', r'\g<chr>', string)
+
+def original_remove_unicode(string: str) -> str:
+    clean = original_squelch_whitespace(string.translate(UNICODE_MAP))
+    try :
+        clean.translate({ ord(i):None for i in ok_unicode }).encode('ascii', 'strict')
+    except UnicodeEncodeError:
+        return None
+    return clean
+
+def original_clean_title(string: str) -> str:
+    clean = original_remove_unicode(string)
+    if not clean :
+        return None
+    return original_squelch_whitespace(re.sub(r' - ', r': ', clean))
+
+def original_sanitise_path(string: str) -> str:
+    return original_squelch_whitespace(original_remove_unicode(string).translate(VALID_PATH_MAP))
+
+def items(feeds: int, count: int) -> list:
+    return [ (F"The {feed} Show’s Host", F"Season   {feed % 3}: “History”", F"Episode {n} – What is going on here? A/B test , part {n % 5}")
+        for feed in range(feeds) for n in range(count) ]
+
+def run(clean_title, remove_unicode, sanitise_path, entries: list) -> list:
+    """
+    The clean up Episode.create, Episode._filename and Podcast._folder do for each item
+    """
+    names = []
+    for author, album, title in entries:
+        title, author, album = clean_title(title), remove_unicode(author), remove_unicode(album)
+        names.append((
+            F"{sanitise_path(author)}/{sanitise_path(album)}",
+            sanitise_path(F"2019-10-21-1100 - {title} - {author} - {album}.mp3"),
+        ))
+    return names
+
+def timed(label: str, function, repeat: int = 1):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        result = function()
+    elapsed = time.perf_counter() - start
+    print(F"{label:<32}{elapsed:10.4f}s")
+    return result
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Benchmark text clean up.')
+    parser.add_argument('--feeds', type=int, default=20, help='Feeds cleaned')
+    parser.add_argument('--items', type=int, default=3000, help='Items in each feed')
+    parser.add_argument('--runs', type=int, default=3, help='Times every feed is cleaned, as repeated runs of a daemon would')
+    args = parser.parse_args()
+
+    entries = items(args.feeds, args.items)
+    expected = timed(F"original x{len(entries)} x{args.runs}", lambda: run(original_clean_title, original_remove_unicode, original_sanitise_path, entries), args.runs)
+    first = timed(F"memoised first run x{len(entries)}", lambda: run(util.clean_title, util.remove_unicode, util.sanitise_path, entries))
+    timed(F"memoised later runs x{args.runs - 1}", lambda: run(util.clean_title, util.remove_unicode, util.sanitise_path, entries), max(1, args.runs - 1))
+    assert first == expected
@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+
+from pathlib import Path
+import tempfile
+import unittest
+
+from ContentIndex import ContentIndex
+
+class TestContentIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.root = Path(self.folder.name)
+        self.podcast_file = self.root / 'author' / 'episode.mp3'
+        self.podcast_file.parent.mkdir()
+        self.podcast_file.write_bytes(b'audio')
+
+    def tearDown(self):
+        self.folder.cleanup()
+
+    def test_find(self):
+        content = ContentIndex(self.root)
+        self.assertEqual(content.find(url="http://a/1.mp3"), (None, None))
+        content.store("abc", "http://a/1.mp3", self.podcast_file)
+        self.assertEqual(content.find(url="http://a/1.mp3"), ("abc", self.podcast_file))
+        self.assertEqual(content.find(url="http://b/1.mp3", digest="abc"), ("abc", self.podcast_file))
+        self.assertEqual(content.find(url="http://b/1.mp3", digest="def"), (None, None))
+
+    def test_missing_file(self):
+        content = ContentIndex(self.root)
+        content.store("abc", "http://a/1.mp3", self.podcast_file)
+        self.podcast_file.unlink()
+        self.assertEqual(content.find(url="http://a/1.mp3"), (None, None))
+        self.assertEqual(content.find(digest="abc"), (None, None))
+
+    def test_persists(self):
+        content = ContentIndex(self.root)
+        content.store("abc", "http://a/1.mp3", self.podcast_file)
+        content.store("abc", "http://a/1.mp3", self.podcast_file)
+        content.close()
+        self.assertEqual(len((self.root / '.content_index').read_text().splitlines()), 1)
+        self.assertEqual(ContentIndex(self.root).find(digest="abc"), ("abc", self.podcast_file))
+
+    def test_compacts(self):
+        content = ContentIndex(self.root)
+        for digest in ["a", "b", "c"]:
+            content.store(digest, "http://a/1.mp3", self.podcast_file)
+        content.close()
+        self.assertEqual((self.root / '.content_index').read_text(), F"c\thttp://a/1.mp3\t{Path('author') / 'episode.mp3'}\n")
+
+    def test_read_only(self):
+        content = ContentIndex(self.root, read_only=True)
+        content.store("abc", "http://a/1.mp3", self.podcast_file)
+        content.close()
+        self.assertEqual(content.find(url="http://a/1.mp3"), ("abc", self.podcast_file))
+        self.assertFalse((self.root / '.content_index').exists())
@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+import tempfile
+import unittest
+from unittest import mock
+
+from CoverCache import CoverCache
+from Http import Http
+
+def response(status: int, data: bytes = b'', headers: dict = {}):
+    return mock.Mock(status=status, data=data, headers=dict({'Content-Type':'image/png'}, **headers))
+
+class TestCoverCache(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.path = Path(self.folder.name) / '.cover_cache'
+
+    def tearDown(self):
+        self.folder.cleanup()
+
+    def test_lazy(self):
+        with mock.patch.object(Http, 'request', return_value=response(200, b'cover')) as request:
+            image = CoverCache(self.path).image("http://yes.no.co.uk/cover.png")
+            request.assert_not_called()
+            self.assertEqual(image.data, b'cover')
+            self.assertEqual(image.type, 'image/png')
+            self.assertEqual(image.data, b'cover')
+            request.assert_called_once()
+
+    def test_shared(self):
+        with mock.patch.object(Http, 'request', side_effect=lambda *a, **k: response(200, bytes(b'cover'))):
+            cache = CoverCache(self.path)
+            self.assertIs(cache.image("http://yes.no.co.uk/a.png"), cache.image("http://yes.no.co.uk/a.png"))
+            self.assertIs(cache.image("http://yes.no.co.uk/a.png").data, cache.image("http://yes.no.co.uk/b.png").data)
+        self.assertEqual(len([ blob for blob in self.path.iterdir() if blob.suffix != '.json' ]), 1)
+
+    def test_revalidate(self):
+        with mock.patch.object(Http, 'request', return_value=response(200, b'cover', {'ETag':'"abc"'})):
+            CoverCache(self.path).image("http://yes.no.co.uk/cover.png").data
+        with mock.patch.object(Http, 'request', return_value=response(304)) as request:
+            self.assertEqual(CoverCache(self.path).image("http://yes.no.co.uk/cover.png").data, b'cover')
+            self.assertEqual(request.call_args[1]['headers'], {'If-None-Match':'"abc"'})
+
+    def test_failure(self):
+        with mock.patch.object(Http, 'request', return_value=response(404)):
+            image = CoverCache(self.path).image("http://yes.no.co.uk/cover.png")
+            self.assertFalse(image)
+            self.assertIsNone(image.data)
+
+    def test_concurrent_store(self):
+        cache = CoverCache(self.path)
+        entries = [ {'url':F"http://yes.no.co.uk/{n}.png", 'digest':'abc', 'type':'image/png'} for n in range(8) ]
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            list(pool.map(lambda entry: cache._store(entry, b'cover'), entries * 20))
+        self.assertEqual(sorted( path.suffix for path in self.path.iterdir() ), ['']+['.json']*8)
+
+    def test_read_only(self):
+        with mock.patch.object(Http, 'request', return_value=response(200, b'cover')):
+            self.assertEqual(CoverCache(self.path, read_only=True).image("http://yes.no.co.uk/cover.png").data, b'cover')
+        self.assertFalse(self.path.exists())
+
+    def test_expire(self):
+        cache = CoverCache(self.path)
+        with mock.patch.object(Http, 'request', return_value=response(200, b'cover', {'ETag':'"abc"'})):
+            cache.image("http://yes.no.co.uk/cover.png").data
+        cache.expire()
+        with mock.patch.object(Http, 'request', return_value=response(304)) as request:
+            self.assertEqual(cache.image("http://yes.no.co.uk/cover.png").data, b'cover')
+            request.assert_called_once()
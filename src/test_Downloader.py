@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+
+from pathlib import Path
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+
+from Downloader import Downloader
+
+class FakeEpisode:
+
+    def __init__(self, url: str, tracker: 'Tracker', fail: bool = False):
+        self.url = url
+        self.tracker = tracker
+        self.fail = fail
+
+    def download_to(self, base_path: Path, content=None, memory_folder: Path = None, memory_limit: int = 0, reserve=None) -> Path:
+        self.tracker.start(self.url)
+        time.sleep(0.02)
+        self.tracker.stop(self.url)
+        if self.fail:
+            raise Exception("broken")
+        return base_path / self.url.rsplit('/', 1)[-1]
+
+class Tracker:
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.running = {}
+        self.total = 0
+        self.peak_total = 0
+        self.peak_host = {}
+
+    def start(self, url: str):
+        host = url.split('/')[2]
+        with self.lock:
+            self.running[host] = self.running.get(host, 0) + 1
+            self.total += 1
+            self.peak_total = max(self.peak_total, self.total)
+            self.peak_host[host] = max(self.peak_host.get(host, 0), self.running[host])
+
+    def stop(self, url: str):
+        host = url.split('/')[2]
+        with self.lock:
+            self.running[host] -= 1
+            self.total -= 1
+
+class TestDownloader(unittest.TestCase):
+
+    def test_limits(self):
+        tracker = Tracker()
+        episodes = [ FakeEpisode(F"http://host{n % 3}.example/{n}.mp3", tracker) for n in range(18) ]
+        with Downloader(workers=4, per_host=1) as downloader:
+            futures = [ downloader.submit(episode, Path('/tmp')) for episode in episodes ]
+            results = [ future.result() for future in futures ]
+        self.assertEqual(results, [ Path(F"/tmp/{n}.mp3") for n in range(18) ])
+        self.assertLessEqual(tracker.peak_total, 3)
+        self.assertEqual(set(tracker.peak_host.values()), {1})
+
+    def test_failure_is_isolated(self):
+        tracker = Tracker()
+        episodes = [ FakeEpisode(F"http://host.example/{n}.mp3", tracker, fail=(n == 1)) for n in range(3) ]
+        with Downloader(workers=2, per_host=2) as downloader:
+            futures = [ downloader.submit(episode, Path('/tmp')) for episode in episodes ]
+            self.assertEqual(futures[0].result(), Path('/tmp/0.mp3'))
+            self.assertRaises(Exception, futures[1].result)
+            self.assertEqual(futures[2].result(), Path('/tmp/2.mp3'))
+
+    def test_measure(self):
+        tracker = Tracker()
+        episode = FakeEpisode("http://host.example/0.mp3", tracker)
+        episode.size = lambda: 1234
+        with Downloader(workers=2, per_host=1) as downloader:
+            self.assertEqual(downloader.measure(episode).result(), 1234)
+        self.assertEqual(tracker.total, 0)
+
+    def test_reserve(self):
+        with tempfile.TemporaryDirectory() as folder, mock.patch('shutil.disk_usage', return_value=mock.Mock(free=1000)):
+            first, second = Path(folder) / "first.mp3", Path(folder) / "second.mp3"
+            downloader = Downloader(memory_folder=Path(folder), memory_limit=1000)
+            self.assertTrue(downloader.reserve(first, 600))
+            self.assertFalse(downloader.reserve(second, 600))
+            #what first has written already counts against the free space
+            first.write_bytes(bytes(400))
+            self.assertTrue(downloader.reserve(second, 500))
+            downloader.release(first)
+            downloader.release(second)
+            self.assertTrue(downloader.reserve(second, 900))
+            downloader.shutdown()
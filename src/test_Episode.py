@@ -1,12 +1,49 @@
 #!/usr/bin/env python3
 
 from collections import OrderedDict
+import hashlib
 import logging
+from pathlib import Path
+import tempfile
 from typing import Tuple
 import unittest
+from unittest import mock
 from parameterized import parameterized
+import mutagen, mutagen.mp3
+from mutagen.id3 import TXXX
 
-from Episode import Episode
+from ContentIndex import ContentIndex
+from Episode import Episode, Image
+from Http import Http
+
+class Stream:
+    """
+    Response body that drops the connection after a number of bytes
+    """
+
+    def __init__(self, data: bytes, status: int = 200, headers: dict = {}, drop_after: int = None):
+        self.data = data
+        self.status = status
+        self.headers = headers
+        self.drop_after = drop_after
+        self.position = 0
+        self.closed = False
+
+    def read(self, size: int = -1) -> bytes:
+        end = len(self.data) if size < 0 else min(len(self.data), self.position + size)
+        if self.drop_after is not None and end > self.drop_after:
+            if self.position >= self.drop_after:
+                raise ConnectionResetError("dropped")
+            end = self.drop_after
+        chunk = self.data[self.position:end]
+        self.position = end
+        return chunk
+
+    def release_conn(self):
+        pass
+
+    def close(self):
+        self.closed = True
 
 logging.basicConfig(level=logging.FATAL)
 
@@ -79,3 +116,158 @@ class TestPodcast(unittest.TestCase):
     ])
     def test_filename(self, name:str, input: Episode, expected: str):
         self.assertEqual(Episode._filename(input), expected)
+
+    def test_tag_single_save(self):
+        episode = Episode("http://yes.no.co.uk/file.mp3", "6989", "title", "author", "album", "2019-10-21-1100", ".mp3", "slkdfjinveosij", Image(b'image', 'image/jpeg'))
+        with tempfile.TemporaryDirectory() as folder:
+            podcast_file = Path(folder) / "episode.mp3"
+            podcast_file.write_bytes((bytes([0xFF, 0xFB, 0x90, 0x64]) + bytes(413)) * 20)
+            with mock.patch.object(mutagen.mp3.MP3, 'save', autospec=True, side_effect=mutagen.mp3.MP3.save) as save:
+                episode._tag(podcast_file)
+                self.assertEqual(save.call_count, 1)
+                metadata = mutagen.File(str(podcast_file))
+                metadata.tags.add(TXXX(encoding=3, desc='REPLAYGAIN_TRACK_GAIN', text=['-1.00 dB']))
+                metadata.save()
+                save.reset_mock()
+                episode._tag(podcast_file)
+                save.assert_not_called()
+            self.assertEqual(Episode.load(podcast_file), episode)
+            metadata = mutagen.File(str(podcast_file))
+            self.assertEqual(len(metadata.tags.getall('APIC')), 1)
+            self.assertIn('TXXX:REPLAYGAIN_TRACK_GAIN', metadata.tags)
+
+    def test_download_resumes(self):
+        data = bytes(range(256)) * 100
+        responses = [
+            Stream(data, headers={'Content-Length':str(len(data)), 'ETag':'"v1"'}, drop_after=1000),
+            Stream(data[1000:], status=206, headers={'Content-Range':F"bytes 1000-{len(data)-1}/{len(data)}"}, drop_after=2000),
+            Stream(data[3000:], status=206, headers={'Content-Range':F"bytes 3000-{len(data)-1}/{len(data)}"}),
+        ]
+        with tempfile.TemporaryDirectory() as folder:
+            podcast_file = Path(folder) / "episode.mp3"
+            with mock.patch.object(Http, 'request', side_effect=responses) as request:
+                self.assertEqual(Episode._download("http://yes.no.co.uk/file.mp3", podcast_file), hashlib.sha256(data).hexdigest())
+            self.assertEqual(podcast_file.read_bytes(), data)
+            self.assertEqual(request.call_args_list[1][1]['headers']['Range'], "bytes=1000-")
+            self.assertEqual(request.call_args_list[1][1]['headers']['If-Range'], '"v1"')
+            self.assertEqual(request.call_args_list[2][1]['headers']['Range'], "bytes=3000-")
+            self.assertFalse((Path(folder) / "episode.mp3.part").exists())
+
+    def test_download_resumes_next_run(self):
+        data = bytes(range(256)) * 100
+        with tempfile.TemporaryDirectory() as folder:
+            podcast_file = Path(folder) / "episode.mp3"
+            with mock.patch.object(Http, 'request', side_effect=lambda *a, **k: Stream(data, headers={'Content-Length':str(len(data))}, drop_after=500)), mock.patch.object(Episode, 'RESUME_ATTEMPTS', 1):
+                self.assertFalse(Episode._download("http://yes.no.co.uk/file.mp3", podcast_file))
+            self.assertEqual(podcast_file.stat().st_size, 500)
+            #server ignores the range and starts again
+            with mock.patch.object(Http, 'request', return_value=Stream(data, headers={'Content-Length':str(len(data))})) as request:
+                self.assertEqual(Episode._download("http://yes.no.co.uk/file.mp3", podcast_file), hashlib.sha256(data).hexdigest())
+            self.assertEqual(request.call_args[1]['headers']['Range'], "bytes=500-")
+            self.assertEqual(podcast_file.read_bytes(), data)
+
+    def test_download_drops_error_body(self):
+        responses = [ Stream(b'not found', status=404) for _ in range(Episode.RESUME_ATTEMPTS) ]
+        with tempfile.TemporaryDirectory() as folder:
+            with mock.patch.object(Http, 'request', side_effect=responses):
+                self.assertIsNone(Episode._download("http://yes.no.co.uk/file.mp3", Path(folder) / "episode.mp3"))
+        self.assertTrue(all( response.closed for response in responses ))
+
+    @parameterized.expand([
+        ["HEAD", [Stream(b'', headers={'Content-Length':'1234'})], 1234],
+        ["HEAD refused", [Stream(b'', status=405), Stream(b'x', status=206, headers={'Content-Range':'bytes 0-0/5678'})], 5678],
+        ["Unknown", [Stream(b'', headers={}), Stream(b'data', headers={})], None],
+    ])
+    def test_size(self, name: str, responses: list, expected: int):
+        episode = Episode("http://yes.no.co.uk/file.mp3", "6989", "title", "author", "album", "2019-10-21-1100", ".mp3", "guid")
+        with mock.patch.object(Http, 'request', side_effect=responses) as request:
+            self.assertEqual(episode.size(), expected)
+        #only a range request answered with the whole enclosure is cut off
+        self.assertEqual(responses[-1].closed, len(responses) > 1 and responses[-1].status != 206)
+        self.assertEqual(request.call_args_list[0][0][0], 'HEAD')
+        self.assertEqual(request.call_count, len(responses))
+
+    @parameterized.expand([
+        ["Small", 1 << 20, "memory"],
+        ["Large", 1000, "download"],
+        ["Reserved", 1 << 20, "memory", True],
+        ["No room", 1 << 20, "download", False],
+    ])
+    def test_download_to_memory(self, name: str, memory_limit: int, folder_name: str, room: bool = None):
+        audio = (bytes([0xFF, 0xFB, 0x90, 0x64]) + bytes(413)) * 20
+        episode = Episode("http://yes.no.co.uk/file.mp3", "6989", "title", "show", "show", "2019-10-21-1100", ".mp3", "guid")
+        with tempfile.TemporaryDirectory() as folder:
+            (Path(folder) / "download").mkdir()
+            with mock.patch.object(Http, 'request', side_effect=lambda *a, **k: Stream(audio, headers={'Content-Length':str(len(audio))})) as request:
+                podcast_file = episode.download_to(Path(folder) / "download", memory_folder=Path(folder) / "memory", memory_limit=memory_limit, reserve=None if room is None else lambda path, length: room)
+            self.assertEqual(request.call_count, 1)
+            self.assertEqual(podcast_file.parent.name, folder_name)
+            self.assertEqual(episode.digest, hashlib.sha256(audio).hexdigest())
+            self.assertEqual(Episode.load(podcast_file), episode)
+
+    def test_download_to_memory_tag_fails(self):
+        audio = (bytes([0xFF, 0xFB, 0x90, 0x64]) + bytes(413)) * 20
+        episode = Episode("http://yes.no.co.uk/file.mp3", "6989", "title", "show", "show", "2019-10-21-1100", ".mp3", "guid")
+        with tempfile.TemporaryDirectory() as folder:
+            (Path(folder) / "download").mkdir()
+            with mock.patch.object(Http, 'request', side_effect=lambda *a, **k: Stream(audio, headers={'Content-Length':str(len(audio))})):
+                with mock.patch.object(Episode, '_tag', side_effect=OSError("broken")):
+                    self.assertRaises(OSError, episode.download_to, Path(folder) / "download", memory_folder=Path(folder) / "memory", memory_limit=1 << 20)
+            self.assertEqual(list((Path(folder) / "memory").iterdir()), [])
+
+    def _library(self, folder: str, audio: bytes) -> Tuple[ContentIndex, Path]:
+        """
+        Library holding one gain analysed episode, indexed by its enclosure URL and content
+        """
+        library = Path(folder) / "library"
+        podcast_file = library / "network" / "episode.mp3"
+        podcast_file.parent.mkdir(parents=True)
+        podcast_file.write_bytes(audio)
+        Episode("http://yes.no.co.uk/file.mp3", "6989", "title", "network", "network", "2019-10-21-1100", ".mp3", "guid", Image(b'network', 'image/jpeg'))._tag(podcast_file)
+        metadata = mutagen.File(str(podcast_file))
+        metadata.tags.add(TXXX(encoding=3, desc='REPLAYGAIN_TRACK_GAIN', text=['-1.00 dB']))
+        metadata.save()
+        content = ContentIndex(library)
+        content.store(hashlib.sha256(audio).hexdigest(), "http://yes.no.co.uk/file.mp3", podcast_file)
+        return content, podcast_file
+
+    @parameterized.expand([
+        ["Same URL", "http://yes.no.co.uk/file.mp3", 0],
+        ["Same content", "http://mirror.no.co.uk/file.mp3", 1],
+    ])
+    def test_download_to_duplicate(self, name: str, url: str, requests: int):
+        audio = (bytes([0xFF, 0xFB, 0x90, 0x64]) + bytes(413)) * 20
+        episode = Episode(url, "6989", "title", "show", "show", "2019-10-21-1100", ".mp3", "guid", Image(b'show', 'image/jpeg'))
+        with tempfile.TemporaryDirectory() as folder:
+            content, source = self._library(folder, audio)
+            with mock.patch.object(Http, 'request', side_effect=lambda *a, **k: Stream(audio, headers={'Content-Length':str(len(audio))})) as request:
+                podcast_file = episode.download_to(Path(folder), content)
+            self.assertEqual(request.call_count, requests)
+            self.assertEqual(episode.duplicate_of, source)
+            self.assertEqual(episode.digest, hashlib.sha256(audio).hexdigest())
+            self.assertEqual(Episode.load(podcast_file), episode)
+            metadata = mutagen.File(str(podcast_file))
+            self.assertEqual([ frame.data for frame in metadata.tags.getall('APIC') ], [b'show'])
+            self.assertIn('TXXX:REPLAYGAIN_TRACK_GAIN', metadata.tags)
+            self.assertEqual(Episode.load(source).author, "network")
+
+    def test_download_to_duplicate_over_partial(self):
+        audio = (bytes([0xFF, 0xFB, 0x90, 0x64]) + bytes(413)) * 20
+        episode = Episode("http://yes.no.co.uk/file.mp3", "6989", "title", "show", "show", "2019-10-21-1100", ".mp3", "guid", Image(b'show', 'image/jpeg'))
+        with tempfile.TemporaryDirectory() as folder:
+            content, source = self._library(folder, audio)
+            partial = Path(folder) / str(episode)
+            partial.write_bytes(audio[:100])
+            partial.with_name(partial.name + '.part').write_text('{}')
+            podcast_file = episode.download_to(Path(folder), content)
+            self.assertEqual(podcast_file, partial)
+            self.assertEqual(Episode.load(podcast_file), episode)
+            self.assertFalse(partial.with_name(partial.name + '.part').exists())
+
+    def test_download_to_identical(self):
+        audio = (bytes([0xFF, 0xFB, 0x90, 0x64]) + bytes(413)) * 20
+        episode = Episode("http://yes.no.co.uk/file.mp3", "6989", "title", "network", "network", "2019-10-21-1100", ".mp3", "guid")
+        with tempfile.TemporaryDirectory() as folder:
+            content, source = self._library(folder, audio)
+            podcast_file = episode.download_to(Path(folder), content)
+            self.assertTrue(podcast_file.samefile(source))
@@ -0,0 +1,51 @@
+#!/usr/bin/env python3
+
+from collections import OrderedDict
+from pathlib import Path
+import tempfile
+import unittest
+
+from FeedCache import FeedCache
+
+URL = "http://url.url.co.url/someplace/here.rss"
+
+ITEM = OrderedDict(
+    title='title',
+    pubDate='Mon, 21 Oct 2019 11:00:00 +0000',
+    guid=OrderedDict({'@isPermaLink':'false', '#text':'slkdfjinveosij'}),
+    description='Very long show notes',
+    enclosure=OrderedDict({'@url':"http://yes.no.co.uk/file.m4a", '@type':"audio/mp4", '@length':"1234"}),
+)
+
+class TestFeedCache(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.cache = FeedCache(Path(self.folder.name) / '.feed_cache')
+
+    def tearDown(self):
+        self.folder.cleanup()
+
+    def test_empty(self):
+        self.assertEqual(self.cache.validators(URL), {})
+        self.assertEqual(self.cache.items(URL), [])
+
+    def test_store(self):
+        self.cache.store(URL, {'ETag':'"abc"', 'Last-Modified':'Mon, 21 Oct 2019 11:00:00 GMT'}, [ITEM])
+        self.assertEqual(self.cache.validators(URL), {'If-None-Match':'"abc"', 'If-Modified-Since':'Mon, 21 Oct 2019 11:00:00 GMT'})
+        self.assertEqual(self.cache.items(URL), [{
+            'title':'title',
+            'pubDate':'Mon, 21 Oct 2019 11:00:00 +0000',
+            'guid':'slkdfjinveosij',
+            'enclosure':{'@url':"http://yes.no.co.uk/file.m4a", '@type':"audio/mp4"},
+        }])
+
+    def test_invalidate(self):
+        self.cache.store(URL, {'ETag':'"abc"'}, [ITEM])
+        self.cache.invalidate(URL)
+        self.assertEqual(self.cache.validators(URL), {})
+        self.assertEqual(len(self.cache.items(URL)), 1)
+
+    def test_read_only(self):
+        FeedCache(self.cache.folder, read_only=True).store(URL, {'ETag':'"abc"'}, [ITEM])
+        self.assertEqual(self.cache.validators(URL), {})
@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+import tempfile
+import unittest
+
+from FeedHealth import FeedHealth
+
+class TestFeedHealth(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.root = Path(self.folder.name) / '.feed_health'
+
+    def tearDown(self):
+        self.folder.cleanup()
+
+    def test_backoff(self):
+        health = FeedHealth(self.root, backoff=60, max_backoff=200)
+        url = "http://a.example/feed"
+        self.assertIsNone(health.blocked(url, 0))
+        for failures, delay in [(1, 60), (2, 120), (3, 200), (4, 200)]:
+            health.failed(url, 1000)
+            self.assertEqual(health.load(url)['failures'], failures)
+            self.assertTrue(health.blocked(url, 1000 + delay - 1).startswith(F"feed failed {failures} times in a row"))
+            self.assertIsNone(health.blocked(url, 1000 + delay))
+        health.succeeded(url, 2000)
+        self.assertEqual(health.load(url), { 'key':url, 'failures':0, 'last_success':2000, 'next_attempt':0 })
+        self.assertIsNone(health.blocked(url, 2000))
+
+    def test_persists(self):
+        FeedHealth(self.root, backoff=60).failed("http://a.example/feed", 1000)
+        self.assertTrue(FeedHealth(self.root, backoff=60).blocked("http://a.example/feed", 1030))
+        FeedHealth(self.root, backoff=60, read_only=True).succeeded("http://a.example/feed", 1030)
+        self.assertTrue(FeedHealth(self.root, backoff=60).blocked("http://a.example/feed", 1030))
+
+    def test_host(self):
+        health = FeedHealth(self.root, backoff=60, host_failures=2)
+        health.failed("http://a.example/gone", 1000)
+        health.failed("http://a.example/1", 1000, unreachable=True)
+        self.assertIsNone(health.blocked("http://a.example/2", 1000))
+        health.failed("http://a.example/2", 1000, unreachable=True)
+        self.assertTrue(health.blocked("http://a.example/3", 1000).startswith("host a.example failed 2 times in a row"))
+        self.assertIsNone(health.blocked("http://b.example/1", 1000))
+        self.assertIsNone(health.blocked("http://a.example/3", 1060))
+        health.succeeded("http://a.example/3", 1060)
+        health.failed("http://a.example/1", 1060, unreachable=True)
+        self.assertIsNone(health.blocked("http://a.example/2", 1060))
+
+    def test_host_shared_by_workers(self):
+        workers = [ FeedHealth(self.root, backoff=60, host_failures=10) for _ in range(2) ]
+        for n in range(6):
+            workers[n % 2].failed(F"http://a.example/{n}", 1000, unreachable=True)
+        self.assertEqual(FeedHealth(self.root).load("host:a.example")['failures'], 6)
+
+    def test_concurrent_failures(self):
+        workers = [ FeedHealth(self.root, backoff=60) for _ in range(4) ]
+        with ThreadPoolExecutor(max_workers=4) as pool:
+            list(pool.map(lambda n: workers[n % 4].failed(F"http://a.example/{n}", 1000, unreachable=True), range(200)))
+        self.assertEqual(list(self.root.glob('*.tmp')), [])
@@ -0,0 +1,49 @@
+#!/usr/bin/env python3
+
+from pathlib import Path
+import tempfile
+import unittest
+from unittest import mock
+
+from Gain import Gain
+
+class TestGain(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.files = []
+        for n in range(3):
+            podcast_file = Path(self.folder.name) / F"{n}.mp3"
+            podcast_file.write_bytes(b'audio')
+            self.files.append(podcast_file)
+
+    def tearDown(self):
+        self.folder.cleanup()
+
+    @mock.patch('r128gain.process')
+    @mock.patch('r128gain.has_loudness_tag', return_value=(True, False))
+    def test_batches(self, has_loudness_tag, process):
+        gain = Gain(batch_size=2, threads=8)
+        self.assertEqual(gain.add(self.files[0], 'a'), [])
+        self.assertEqual(gain.add(self.files[1], 'b'), [('a', self.files[0], True), ('b', self.files[1], True)])
+        process.assert_called_once_with([str(self.files[0]), str(self.files[1])], thread_count=2)
+        self.assertEqual(gain.add(self.files[2], 'c'), [])
+        self.assertEqual(gain.flush(), [('c', self.files[2], True)])
+        self.assertEqual(gain.flush(), [])
+
+    @mock.patch('r128gain.process')
+    @mock.patch('r128gain.has_loudness_tag', side_effect=lambda podcast_file: (not podcast_file.endswith('1.mp3'), False))
+    def test_failure_per_file(self, has_loudness_tag, process):
+        gain = Gain(batch_size=3)
+        for n, podcast_file in enumerate(self.files):
+            results = gain.add(podcast_file, n)
+        self.assertEqual([ (item, success) for item, podcast_file, success in results ], [(0, True), (1, False), (2, True)])
+
+    @mock.patch('r128gain.process')
+    @mock.patch('r128gain.has_loudness_tag', return_value=(True, False))
+    def test_already_analysed(self, has_loudness_tag, process):
+        gain = Gain()
+        gain.add(self.files[0], 'a')
+        gain.add(self.files[1], 'b', analyse=False)
+        self.assertEqual(gain.flush(), [('a', self.files[0], True), ('b', self.files[1], True)])
+        process.assert_called_once_with([str(self.files[0])], thread_count=1)
@@ -0,0 +1,52 @@
+#!/usr/bin/env python3
+
+import os
+from pathlib import Path
+import tempfile
+import time
+import unittest
+
+from Leases import Leases
+
+class TestLeases(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.root = Path(self.folder.name) / '.leases'
+
+    def tearDown(self):
+        self.folder.cleanup()
+
+    def test_claim(self):
+        first = Leases(self.root, 'first')
+        second = Leases(self.root, 'second')
+        self.assertTrue(first.claim("http://a/feed"))
+        self.assertTrue(first.claim("http://a/feed"))
+        self.assertFalse(second.claim("http://a/feed"))
+        self.assertTrue(second.claim("http://b/feed"))
+        first.release("http://a/feed")
+        self.assertTrue(second.claim("http://a/feed"))
+        second.release_all()
+        self.assertEqual(list(self.root.iterdir()), [])
+
+    def test_stale(self):
+        first = Leases(self.root, 'first', duration=60)
+        second = Leases(self.root, 'second', duration=60)
+        self.assertTrue(first.claim("http://a/feed"))
+        path = first.held["http://a/feed"]
+        os.utime(path, (time.time() - 120, time.time() - 120))
+        with self.assertLogs(level='WARNING'):
+            self.assertTrue(second.claim("http://a/feed"))
+        self.assertEqual(path.read_text(), "second\thttp://a/feed\n")
+        self.assertEqual(list(self.root.iterdir()), [path])
+
+    def test_renew(self):
+        first = Leases(self.root, 'first', duration=60)
+        second = Leases(self.root, 'second', duration=60)
+        self.assertTrue(first.claim("http://a/feed"))
+        path = first.held["http://a/feed"]
+        os.utime(path, (time.time() - 120, time.time() - 120))
+        first.renew()
+        self.assertLess(path.stat().st_mtime, time.time() - 60)
+        first.renew(force=True)
+        self.assertFalse(second.claim("http://a/feed"))
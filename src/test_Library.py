@@ -0,0 +1,54 @@
+#!/usr/bin/env python3
+
+import os
+from pathlib import Path
+import tempfile
+import unittest
+from unittest import mock
+
+from Episode import Episode
+from Library import Library
+
+EPISODE = Episode("http://yes.no.co.uk/file.mp3", "6989", "title", "author", "album", "2019-10-21-1100", ".mp3", "slkdfjinveosij")
+
+class TestLibrary(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.path = Path(self.folder.name)
+        self.podcast_file = self.path / "author" / "album" / str(EPISODE)
+        self.podcast_file.parent.mkdir(parents=True)
+        self.podcast_file.write_bytes((bytes([0xFF, 0xFB, 0x90, 0x64]) + bytes(413)) * 20)
+        EPISODE._tag(self.podcast_file)
+
+    def tearDown(self):
+        self.folder.cleanup()
+
+    def test_load(self):
+        library = Library(self.path)
+        self.assertEqual(library.load(self.podcast_file), EPISODE)
+        library.close()
+        with mock.patch.object(Episode, 'load') as load:
+            self.assertEqual(Library(self.path).load(self.podcast_file), EPISODE)
+            load.assert_not_called()
+        os.utime(self.podcast_file, ns=(0, 0))
+        with mock.patch.object(Episode, 'load', return_value=EPISODE) as load:
+            Library(self.path).load(self.podcast_file)
+            load.assert_called_once_with(self.podcast_file)
+
+    def test_update(self):
+        library = Library(self.path)
+        library.update(self.podcast_file, EPISODE)
+        library.close()
+        self.assertEqual(Library(self.path).entries[str(self.podcast_file.relative_to(self.path))][2], EPISODE.serialise())
+
+    def test_rebuild(self):
+        (self.path / ".hidden").mkdir()
+        (self.path / ".hidden" / "skip.mp3").write_bytes(b'')
+        library = Library(self.path)
+        self.assertEqual(library.rebuild(workers=2), 1)
+        self.assertEqual(list(library.entries), [str(self.podcast_file.relative_to(self.path))])
+        self.assertEqual(Library(self.path).rebuild(workers=2), 0)
+        self.podcast_file.unlink()
+        Library(self.path).rebuild(workers=2)
+        self.assertEqual(Library(self.path).entries, {})
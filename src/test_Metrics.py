@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+
+import json
+from pathlib import Path
+import tempfile
+import unittest
+
+from Metrics import Metrics
+
+class TestMetrics(unittest.TestCase):
+
+    def setUp(self):
+        Metrics.reset()
+        self.folder = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        Metrics.reset()
+        self.folder.cleanup()
+
+    def test_count(self):
+        Metrics.count('feeds', status='200')
+        Metrics.count('feeds', status='304')
+        Metrics.count('feeds', status='304')
+        Metrics.count('download_bytes', 1024, host='a.b')
+        self.assertEqual(Metrics.snapshot(), {
+            'download_bytes': [{'labels':{'host':'a.b'}, 'value':1024}],
+            'feeds': [{'labels':{'status':'200'}, 'value':1}, {'labels':{'status':'304'}, 'value':2}],
+        })
+
+    def test_timer(self):
+        with self.assertRaises(ValueError):
+            with Metrics.timer('download', 'a.b'):
+                raise ValueError()
+        metrics = Metrics.snapshot()
+        self.assertEqual(metrics['stage_calls'], [{'labels':{'stage':'download'}, 'value':1}])
+        self.assertEqual([ sample['labels'] for sample in metrics['host_seconds'] ], [{'host':'a.b', 'stage':'download'}])
+        self.assertGreaterEqual(metrics['stage_seconds'][0]['value'], 0)
+
+    def test_write(self):
+        Metrics.count('episodes_skipped', by='record')
+        Metrics.count('feeds', status='say "hi"')
+        Metrics.write(Path(self.folder.name), 1000.0, 1)
+
+        summary = json.loads((Path(self.folder.name) / Metrics.JSON_FILE).read_text())
+        self.assertEqual(summary['exit_code'], 1)
+        self.assertEqual(summary['metrics']['episodes_skipped'], [{'labels':{'by':'record'}, 'value':1}])
+
+        lines = (Path(self.folder.name) / Metrics.PROMETHEUS_FILE).read_text().splitlines()
+        self.assertIn('# TYPE ichapod_episodes_skipped_total counter', lines)
+        self.assertIn('ichapod_episodes_skipped_total{by="record"} 1', lines)
+        self.assertIn('ichapod_feeds_total{status="say \\"hi\\""} 1', lines)
+        self.assertIn('ichapod_run_exit_code 1', lines)
+        self.assertEqual(sorted( path.name for path in Path(self.folder.name).iterdir() ), [Metrics.JSON_FILE, Metrics.PROMETHEUS_FILE])
+
+    def test_write_worker(self):
+        Metrics.count('episodes_skipped', by='record')
+        Metrics.write(Path(self.folder.name), 1000.0, 0, 'first')
+
+        summary = json.loads((Path(self.folder.name) / '.metrics.first.json').read_text())
+        self.assertEqual(summary['worker'], 'first')
+        lines = (Path(self.folder.name) / '.metrics.first.prom').read_text().splitlines()
+        self.assertIn('ichapod_episodes_skipped_total{by="record",worker="first"} 1', lines)
+        self.assertIn('ichapod_run_exit_code{worker="first"} 0', lines)
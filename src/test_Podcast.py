@@ -1,13 +1,52 @@
 #!/usr/bin/env python3
 
+from collections import OrderedDict
+import logging
 from typing import List
 import unittest
+from unittest import mock
 from parameterized import parameterized
 
+from Http import Http
 from Podcast import Podcast
 
+FEED = b"""<?xml version="1.0" encoding="UTF-8"?>
+<rss xmlns:itunes="http://www.itunes.com/dtds/podcast-1.0.dtd" version="2.0">
+<channel>
+<title>Channel</title>
+<itunes:image href="http://yes.no.co.uk/itunes.png"/>
+<image><url>http://yes.no.co.uk/cover.png</url><title>Channel</title></image>
+<item>
+<title>one</title>
+<pubDate>Mon, 21 Oct 2019 11:00:00 +0000</pubDate>
+<guid isPermaLink="false">g1</guid>
+<enclosure url="http://yes.no.co.uk/1.mp3" type="audio/mpeg"/>
+</item>
+<item>
+<title><![CDATA[two & more]]></title>
+<pubDate>Tue, 22 Oct 2019 11:00:00 +0000</pubDate>
+<guid>g2</guid>
+<enclosure url="http://yes.no.co.uk/2.mp3" type="audio/mpeg"/>
+</item>
+<item>
+<title>three</title>
+<pubDate>Wed, 23 Oct 2019 11:00:00 +0000</pubDate>
+<guid>g3</guid>
+</item>
+</channel>
+</rss>
+"""
+
 class TestPodcast(unittest.TestCase):
 
+    def setUp(self):
+        #deferred messages are only kept at levels being logged
+        self.level = logging.getLogger().level
+        logging.getLogger().setLevel(logging.WARNING)
+
+    def tearDown(self):
+        logging.getLogger().setLevel(self.level)
+
     @parameterized.expand([
         ["URL Only",
          "http://url.url.co.url/someplace/here.rss",
@@ -61,6 +100,95 @@ class TestPodcast(unittest.TestCase):
     def test_get_manifest(self):
         url = "http://guiltyfeminist.libsyn.com/rss"
 
-        result = Podcast(url)._get_manifest()
-        self.assertIsInstance(result, dict)
-        self.assertIsNotNone(result)
+        result = list(Podcast(url).episodes())
+        self.assertIsInstance(result, list)
+        self.assertNotEqual(result, [])
+
+    def test_stream_items(self):
+        chunks = [ FEED[n:n+7] for n in range(0, len(FEED), 7) ]
+        result = list(Podcast._stream_items(chunks))
+        self.assertEqual(result, [
+            ('title', 'Channel'),
+            ('image', 'http://yes.no.co.uk/cover.png'),
+            ('item', OrderedDict(title='one', pubDate='Mon, 21 Oct 2019 11:00:00 +0000', guid=OrderedDict({'@isPermaLink':'false', '#text':'g1'}), enclosure=OrderedDict({'@url':'http://yes.no.co.uk/1.mp3', '@type':'audio/mpeg'}))),
+            ('item', OrderedDict(title='two & more', pubDate='Tue, 22 Oct 2019 11:00:00 +0000', guid='g2', enclosure=OrderedDict({'@url':'http://yes.no.co.uk/2.mp3', '@type':'audio/mpeg'}))),
+            ('item', OrderedDict(title='three', pubDate='Wed, 23 Oct 2019 11:00:00 +0000', guid='g3')),
+        ])
+
+    def test_stop_after_known(self):
+        record = mock.Mock()
+        record.check.return_value = True
+        response = mock.Mock(status=200, headers={})
+        response.stream.return_value = [FEED]
+        podcast = Podcast("http://url.url.co.url/someplace/here.rss", "Author")
+        with mock.patch.object(Http, 'request', return_value=response) as request:
+            podcast.refresh(record=record, stop_after_known=1)
+        episodes = list(podcast.episodes())
+        self.assertEqual([ episode.title for episode in episodes ], ['one'])
+        self.assertEqual(episodes[0].cover_image.url, 'http://yes.no.co.uk/cover.png')
+        response.close.assert_called()
+        #the cover is only requested once it is needed
+        request.assert_called_once()
+
+    def test_refresh_defers_logging(self):
+        podcast = Podcast("http://url.url.co.url/someplace/here.rss", "Author")
+        with mock.patch.object(Http, 'request', side_effect=Exception("no network")):
+            podcast.refresh()
+        with self.assertLogs(level='ERROR') as logs:
+            self.assertEqual(list(podcast.episodes()), [])
+        self.assertIn("Failed to refresh http://url.url.co.url/someplace/here.rss", logs.output[0])
+
+    def test_refresh_skips_bad_item(self):
+        response = mock.Mock(status=200, headers={})
+        response.stream.return_value = [FEED.replace(b"Tue, 22 Oct 2019 11:00:00 +0000", b"Someday soon").replace(b"<title>three</title>", b"<title>three</title><enclosure url=\"http://yes.no.co.uk/3.mp3\" type=\"audio/mpeg\"/>")]
+        podcast = Podcast("http://url.url.co.url/someplace/here.rss", "Author")
+        with mock.patch.object(Http, 'request', return_value=response):
+            podcast.refresh()
+        with self.assertLogs(level='WARNING') as logs:
+            self.assertEqual([ episode.guid for episode in podcast.episodes() ], ['g1', 'g3'])
+        self.assertIn("Something was wrong with Author - Author - two & more", logs.output[0])
+        self.assertIsNone(podcast.failure)
+        self.assertFalse(podcast.unreachable)
+
+    @parameterized.expand([
+        ["Unreachable", OSError("no network"), 'unreachable', True],
+        ["Error", ValueError("bug"), 'error', False],
+    ])
+    def test_refresh_failure(self, name: str, error: Exception, failure: str, unreachable: bool):
+        podcast = Podcast("http://url.url.co.url/someplace/here.rss", "Author")
+        with mock.patch.object(Http, 'request', side_effect=error):
+            podcast.refresh()
+        self.assertEqual(podcast.failure, failure)
+        self.assertEqual(podcast.unreachable, unreachable)
+
+    @parameterized.expand([
+        ["Complete", False, {'ETag':'"v1"'}],
+        ["Failed", True, {}],
+    ])
+    def test_settle(self, name: str, failed: bool, expected: dict):
+        cache = mock.Mock()
+        cache.validators.return_value = {}
+        response = mock.Mock(status=200, headers={'ETag':'"v1"'})
+        response.stream.return_value = [FEED]
+        podcast = Podcast("http://url.url.co.url/someplace/here.rss", "Author")
+        with mock.patch.object(Http, 'request', return_value=response):
+            podcast.refresh(cache=cache)
+        for episode in podcast.episodes():
+            podcast.expect()
+        podcast.settle(cache)
+        podcast.settle(cache, failed=failed)
+        cache.store.assert_not_called()
+        podcast.settle(cache)
+        cache.store.assert_called_once()
+        self.assertEqual(cache.store.call_args[0][1], expected)
+
+    def test_refresh_defers_cleanup_warnings(self):
+        response = mock.Mock(status=200, headers={})
+        response.stream.return_value = [FEED]
+        podcast = Podcast("http://url.url.co.url/someplace/here.rss", u"Author ÷")
+        with mock.patch.object(Http, 'request', return_value=response):
+            with self.assertNoLogs(level='WARNING'):
+                podcast.refresh()
+        with self.assertLogs(level='WARNING') as logs:
+            self.assertEqual(list(podcast.episodes()), [])
+        self.assertIn("Failed to remove character from Author", logs.output[0])
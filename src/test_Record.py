@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+
+from pathlib import Path
+import tempfile
+import unittest
+
+from Episode import Episode
+from Leases import Leases
+from Record import Record
+
+EPISODE = Episode("http://yes.no.co.uk/file.mp3", "6989", "title", "author", "album", "2019-10-21-1100", ".mp3", "slkdfjinveosij")
+OTHER = Episode("http://yes.no.co.uk/other.mp3", "6990", "other", "author", "album", "2019-10-22-1100", ".mp3", "sdfwefwe")
+
+class TestRecord(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.path = Path(self.folder.name) / '.download_record'
+
+    def tearDown(self):
+        self.folder.cleanup()
+
+    def test_identity_of(self):
+        self.assertEqual(Episode.identity_of(EPISODE.serialise()), EPISODE.identity())
+
+    def test_check(self):
+        self.path.write_text(EPISODE.serialise()+'\n')
+        record = Record(self.path)
+        self.assertTrue(record.check(EPISODE))
+        self.assertFalse(record.check(Episode("http://yes.no.co.uk/file.mp3", "6989", "title", "author", "album", "2019-10-21-1100", ".mp3", "other")))
+
+    def test_store(self):
+        record = Record(self.path)
+        self.assertFalse(record.check(EPISODE))
+        record.store(EPISODE)
+        self.assertTrue(record.check(EPISODE))
+        self.assertTrue(Record(self.path).check(EPISODE))
+        record.compact()
+        self.assertFalse(record.journal_path.exists())
+        self.assertEqual(self.path.read_text(), EPISODE.serialise()+'\n')
+        self.assertTrue(Record(self.path).check(EPISODE))
+
+    def test_compact_merges_sorted(self):
+        lines = sorted([ EPISODE.serialise(), OTHER.serialise() ])
+        self.path.write_text(lines[1]+'\n')
+        record = Record(self.path)
+        record.store(EPISODE)
+        record.store(OTHER)
+        record.compact()
+        self.assertEqual(self.path.read_text(), "".join( line+'\n' for line in lines ))
+
+    def test_periodic_compaction(self):
+        record = Record(self.path, compact_every=2)
+        record.store(EPISODE)
+        self.assertFalse(record.close())
+        self.assertFalse(self.path.exists())
+        record = Record(self.path, compact_every=2)
+        record.store(OTHER)
+        self.assertTrue(record.close())
+        self.assertEqual(len(Record(self.path).index), 2)
+
+    def test_incomplete_journal(self):
+        record = Record(self.path)
+        record.store(EPISODE)
+        with record.journal_path.open(mode='a') as journal:
+            journal.write("half\twritten")
+        record = Record(self.path)
+        self.assertEqual(record.new_entries, [EPISODE.serialise()])
+        self.assertEqual(record.journal_path.read_text(), EPISODE.serialise()+'\n')
+
+    def test_read_only(self):
+        record = Record(self.path, read_only=True)
+        record.store(EPISODE)
+        self.assertTrue(record.check(EPISODE))
+        self.assertFalse(record.journal_path.exists())
+
+    def test_mapped(self):
+        episodes = [ Episode(F"http://yes.no.co.uk/{n}.mp3", n, F"title {n}", F"author {n % 7}", "album", F"2019-10-{1 + n % 28:02}-1100", ".mp3", F"guid {n}") for n in range(200) ]
+        self.path.write_text("".join(sorted( episode.serialise()+'\n' for episode in episodes )))
+        record = Record(self.path, mapped=True)
+        self.assertEqual(record.index, set())
+        for episode in episodes:
+            self.assertTrue(record.check(episode))
+        self.assertFalse(record.check(EPISODE))
+        self.assertFalse(record.check(Episode("http://yes.no.co.uk/0.mp3", 0, "title 0", "author 0", "album", "2019-10-01-1100", ".mp3", "guid 999")))
+        record.store(EPISODE)
+        record.compact()
+        self.assertTrue(record.check(EPISODE))
+        self.assertTrue(record.check(episodes[0]))
+        record.close()
+
+    def test_mapped_empty(self):
+        self.assertFalse(Record(self.path, mapped=True).check(EPISODE))
+        self.path.write_text("")
+        self.assertFalse(Record(self.path, mapped=True).check(EPISODE))
+
+    def test_segments(self):
+        first = Record(self.path, compact_every=10, segment='first')
+        second = Record(self.path, compact_every=10, segment='second')
+        first.store(EPISODE)
+        second.store(OTHER)
+        self.assertNotEqual(first.journal_path, second.journal_path)
+        self.assertTrue(Record(self.path).check(OTHER))
+        self.assertFalse(first.close())
+        self.assertEqual(len(list(self.path.parent.glob('.download_record.first.*.segment'))), 1)
+        self.assertTrue(Record(self.path, segment='third').check(EPISODE))
+        self.assertFalse(second.close())
+        self.assertFalse(self.path.exists())
+
+    def test_segments_merge(self):
+        leases = Leases(Path(self.folder.name) / '.leases', 'first')
+        for segment, episode in [('second', OTHER), ('first', EPISODE)]:
+            record = Record(self.path, compact_every=2, segment=segment, leases=leases)
+            record.store(episode)
+            record.close()
+        self.assertEqual(self.path.read_text(), "".join(sorted( episode.serialise()+'\n' for episode in [EPISODE, OTHER] )))
+        self.assertEqual(sorted( path.name for path in Path(self.folder.name).iterdir() ), ['.download_record', '.leases'])
+        self.assertEqual(leases.held, {})
+
+    def test_segments_merge_leased(self):
+        leases = Leases(Path(self.folder.name) / '.leases', 'first')
+        Leases(Path(self.folder.name) / '.leases', 'second').claim(str(self.path))
+        record = Record(self.path, compact_every=1, segment='first', leases=leases)
+        record.store(EPISODE)
+        self.assertFalse(record.close())
+        self.assertFalse(self.path.exists())
+        self.assertTrue(Record(self.path).check(EPISODE))
+
+    def test_checkpoint_keeps_mapping(self):
+        self.path.write_text(EPISODE.serialise()+'\n')
+        record = Record(self.path, compact_every=1, mapped=True)
+        self.assertFalse(record.checkpoint())
+        self.assertTrue(record.check(EPISODE))
+        record.store(OTHER)
+        self.assertTrue(record.checkpoint())
+        self.assertTrue(record.check(EPISODE))
+        self.assertTrue(record.check(OTHER))
+        record.close()
@@ -0,0 +1,41 @@
+#!/usr/bin/env python3
+
+from datetime import datetime, timedelta
+import unittest
+from parameterized import parameterized
+
+from Podcast import Podcast
+from Schedule import Schedule
+
+NOW = datetime(2020, 1, 31, 12, 0)
+
+def items(gap: timedelta, count: int = 10, last: datetime = NOW) -> list:
+    return [ {'pubDate':(last - gap * n).strftime("%a, %d %b %Y %H:%M:%S +0000")} for n in range(count) ]
+
+class TestSchedule(unittest.TestCase):
+
+    @parameterized.expand([
+        ["Daily", items(timedelta(days=1)), 3600],
+        ["Weekly", items(timedelta(days=7)), 7 * 3600],
+        ["Hourly", items(timedelta(hours=1)), 3600],
+        ["Dormant", items(timedelta(days=7), last=NOW - timedelta(days=400)), 7 * 86400],
+        ["Unknown", [], 3600],
+        ["Broken dates", [{'pubDate':'not a date'}, {}], 3600],
+    ])
+    def test_interval(self, name: str, input: list, expected: float):
+        self.assertAlmostEqual(Schedule().interval(input, NOW.timestamp()), expected)
+
+    def test_due(self):
+        now = NOW.timestamp()
+        new, known = Podcast("http://new.co.uk/rss"), Podcast("http://known.co.uk/rss")
+        schedule = Schedule()
+        schedule.track([new, known], {known.url:items(timedelta(days=7))}, now)
+        self.assertEqual(schedule.due(now), [new])
+        self.assertEqual(schedule.due(now + 7 * 3600), [new, known])
+
+        schedule.polled(new, items(timedelta(days=1)), now)
+        self.assertNotIn(new, schedule.due(now + 3599))
+        self.assertIn(new, schedule.due(now + 3600))
+
+        schedule.track([known], {}, now)
+        self.assertEqual(list(schedule.entries), [known.url])
@@ -1,7 +1,11 @@
 #!/usr/bin/env python3
 
+import contextlib
+from pathlib import Path
+import tempfile
 from typing import Tuple
 import unittest
+from unittest import mock
 from parameterized import parameterized
 
 from util import *
@@ -47,6 +51,30 @@ class TestUtil(unittest.TestCase):
          "2019-04-18-0000",
          #"2019-10-23-1600",
         ],
+        ["Stored",
+         "2019-10-21-1100",
+         "2019-10-21-1100",
+        ],
+        ["Single digit day without weekday",
+         "1 Oct 2019 06:24 +0100",
+         "2019-10-01-0624",
+        ],
+        ["Full month name",
+         "Tue, 01 October 2019 06:24:00 GMT",
+         "2019-10-01-0624",
+        ],
+        ["ISO",
+         "2019-10-21T11:00:00Z",
+         "2019-10-21-1100",
+        ],
+        ["ISO with offset",
+         "2019-10-21T23:30:00.000-07:00",
+         "2019-10-21-2330",
+        ],
+        ["Twelve hour clock",
+         "Mon, 21 Oct 2019 11:00 PM",
+         "2019-10-21-2300",
+        ],
     ])
     def test_parse_date(self, name:str, input: str, expected: str):
         self.assertEqual(convert_date(input), expected)
@@ -109,6 +137,22 @@ class TestUtil(unittest.TestCase):
     def test_remove_unicode(self, name:str, input: str, expected: str):
         self.assertEqual(remove_unicode(input), expected)
 
+    def test_deferred_log_drops_disabled_levels(self):
+        log = DeferredLog()
+        level = logging.getLogger().level
+        logging.getLogger().setLevel(logging.INFO)
+        try:
+            log.debug("dropped")
+            log.info("kept")
+        finally:
+            logging.getLogger().setLevel(level)
+        self.assertEqual(log.messages, [(logging.INFO, "kept")])
+
+    def test_remove_unicode_warns_every_time(self):
+        for _ in range(2):
+            with self.assertLogs(level='WARNING'):
+                self.assertIsNone(remove_unicode(u"memo \u00F7"))
+
     @parameterized.expand([
         ["Simple",
          "A generally good title",
@@ -147,6 +191,16 @@ class TestUtil(unittest.TestCase):
     def test_sanitise_path(self, name:str, input: str, expected: str):
         self.assertEqual(sanitise_path(input), expected)
 
+    @parameterized.expand([
+        ["Runs of spaces", "a   b", "a b"],
+        ["Before comma", "a \t ,b", "a,b"],
+        ["Tab after last space kept", "a \t \tb", "a \tb"],
+        ["Lone tab kept", "a\tb", "a\tb"],
+        ["Unchanged", "a, b", "a, b"],
+    ])
+    def test_squelch_whitespace(self, name:str, input: str, expected: str):
+        self.assertEqual(squelch_whitespace(input), expected)
+
     @parameterized.expand([
         ["Prefix bob left",
          (['adam', 'bob', 'bob', 'bob', 'bobby', 'bobert', 'chris'], string_prefix_comparator_left('bob')),
@@ -175,3 +229,34 @@ class TestUtil(unittest.TestCase):
     ])
     def test_bisect(self, name: str, input: Tuple, expected: int):
         self.assertEqual(GenericBisect.bisect(*input), expected)
+
+    def test_place_file(self):
+        with tempfile.TemporaryDirectory() as folder:
+            source, target = Path(folder) / 'source', Path(folder) / 'target'
+            source.write_bytes(b'episode')
+            place_file(source, target)
+            self.assertFalse(source.exists())
+            self.assertEqual(target.read_bytes(), b'episode')
+
+            source.write_bytes(b'other')
+            self.assertRaises(FileExistsError, place_file, source, target)
+            self.assertEqual(target.read_bytes(), b'episode')
+            self.assertTrue(source.exists())
+
+    @parameterized.expand([
+        ["reflink", ()],
+        ["kernel", ('fcntl.ioctl',)],
+        ["no copy_file_range", ('fcntl.ioctl', 'util.os.copy_file_range')],
+        ["userspace", ('fcntl.ioctl', 'util.os.copy_file_range', 'util.os.sendfile')],
+    ])
+    def test_copy_file(self, name: str, missing: Tuple[str]):
+        data = bytes(range(256)) * 40000
+        with tempfile.TemporaryDirectory() as folder:
+            source, target = Path(folder) / 'source', Path(folder) / 'target'
+            source.write_bytes(data)
+            with mock.patch('util.COPY_CHUNK', 4096), contextlib.ExitStack() as patches:
+                for call in missing:
+                    patches.enter_context(mock.patch(call, side_effect=OSError))
+                copy_file(source, target)
+            self.assertEqual(target.read_bytes(), data)
+            self.assertRaises(FileExistsError, copy_file, source, target)
@@ -1,9 +1,11 @@
 
 from datetime import datetime
-from dateutil import parser, tz
+import functools
 import logging
-import pytz
+import os
+from pathlib import Path
 import re
+import shutil
 
 ERROR: int = 0
 
@@ -45,21 +47,27 @@ __valid_path_map = {
     ord('?'):None,
 }
 
-__tzinfos = {
-    'GMT': tz.gettz('Europe/GMT'),
-    'PST': tz.gettz('US/Pacific'),
-    'PDT': tz.gettz('US/Pacific'),
-    'PT': tz.gettz('US/Pacific'),
-    'MST': tz.gettz('US/Mountain'),
-    'MDT': tz.gettz('US/Mountain'),
-    'MT': tz.gettz('US/Mountain'),
-    'CST': tz.gettz('US/Central'),
-    'CDT': tz.gettz('US/Central'),
-    'CT': tz.gettz('US/Central'),
-    'EST': tz.gettz('US/Eastern'),
-    'EDT': tz.gettz('US/Eastern'),
-    'ET': tz.gettz('US/Eastern')
-}
+@functools.lru_cache(maxsize=None)
+def _tzinfos() -> dict:
+    """
+    Zone abbreviations seen in feeds, only loaded the first time a date needs parsing
+    """
+    from dateutil import tz
+    return {
+        'GMT': tz.gettz('Europe/GMT'),
+        'PST': tz.gettz('US/Pacific'),
+        'PDT': tz.gettz('US/Pacific'),
+        'PT': tz.gettz('US/Pacific'),
+        'MST': tz.gettz('US/Mountain'),
+        'MDT': tz.gettz('US/Mountain'),
+        'MT': tz.gettz('US/Mountain'),
+        'CST': tz.gettz('US/Central'),
+        'CDT': tz.gettz('US/Central'),
+        'CT': tz.gettz('US/Central'),
+        'EST': tz.gettz('US/Eastern'),
+        'EDT': tz.gettz('US/Eastern'),
+        'ET': tz.gettz('US/Eastern')
+    }
 
 def set_error(code: int = 1):
     global ERROR
@@ -69,39 +77,134 @@ def set_error(code: int = 1):
 def get_error() -> int:
     return ERROR
 
+class DeferredLog:
+    """
+    Collects log messages on a worker thread so they can be emitted later, in order, from the main thread
+    """
+
+    def __init__(self):
+        self.messages = []
+
+    def _defer(self, level: int, message: str):
+        #held until replay(), so only what would be emitted is kept
+        if logging.getLogger().isEnabledFor(level):
+            self.messages.append((level, message))
+
+    def debug(self, message: str):
+        self._defer(logging.DEBUG, message)
+
+    def info(self, message: str):
+        self._defer(logging.INFO, message)
+
+    def warning(self, message: str):
+        self._defer(logging.WARNING, message)
+
+    def error(self, message: str):
+        self._defer(logging.ERROR, message)
+
+    def replay(self):
+        for level, message in self.messages:
+            logging.log(level, message)
+        self.messages = []
+
+__months = { name:number for number, names in enumerate([
+    ('jan', 'january'), ('feb', 'february'), ('mar', 'march'), ('apr', 'april'), ('may',), ('jun', 'june'),
+    ('jul', 'july'), ('aug', 'august'), ('sep', 'sept', 'september'), ('oct', 'october'), ('nov', 'november'), ('dec', 'december'),
+], start=1) for name in names }
+
+# words dateutil reads as something other than a zone, which must go the slow way
+__not_zones = set(__months) | { 'am', 'pm', 'a', 'p', 'mon', 'tue', 'wed', 'thu', 'fri', 'sat', 'sun' }
+
+__rfc822_date = re.compile(r'^\s*(?:[A-Za-z]{3,9},?\s+)?(?P<day>\d{1,2})\s+(?P<month>[A-Za-z]{3,9})\s+(?P<year>\d{4})\s+(?P<hour>\d{1,2}):(?P<minute>\d{2})(?::(?P<second>\d{2}))?(?:\s*(?:[+-]\d{2}:?\d{2}|(?P<zone>[A-Za-z]{1,5})))?\s*$')
+__iso_date = re.compile(r'^\s*(?P<year>\d{4})-(?P<month>\d{2})-(?P<day>\d{2})[T ](?P<hour>\d{2}):(?P<minute>\d{2})(?::(?P<second>\d{2})(?:\.\d+)?)?\s*(?:Z|[+-]\d{2}:?\d{2})?\s*$')
+__loading_date = re.compile(r'^(?P<date>\d{4}-\d{2}-\d{2}).(?P<time>\d{0,3})$')
+__stored_date = re.compile(r'^(?P<year>\d{4})-(?P<month>\d{2})-(?P<day>\d{2})(?:.(?P<short>\d{1,3})|[- ](?P<time>\d{4}))$')
+
+EPOCH = datetime(2000, 9, 1) # Start of podcast history
+
+def _fast_date(date: str) -> datetime:
+    """
+    Read the wall clock time of the RFC 822, ISO 8601 and stored forms feeds and tags actually use, or None for anything else
+    """
+    match = __rfc822_date.match(date)
+    if match:
+        month = __months.get(match.group('month').lower())
+        zone = match.group('zone')
+        if not month or (zone and zone.lower() in __not_zones):
+            return None
+        return datetime(int(match.group('year')), month, int(match.group('day')), int(match.group('hour')), int(match.group('minute')), int(match.group('second') or 0))
+    match = __iso_date.match(date)
+    if match:
+        return datetime(*( int(match.group(part) or 0) for part in ['year', 'month', 'day', 'hour', 'minute', 'second'] ))
+    match = __stored_date.match(date)
+    if match:
+        time = int(match.group('short') or match.group('time'))
+        return datetime(int(match.group('year')), int(match.group('month')), int(match.group('day')), time // 100, time % 100)
+    return None
+
+@functools.lru_cache(maxsize=1<<16)
 def convert_date(date: str) -> str:
-    loading_date = re.match(r'^(?P<date>\d{4}-\d{2}-\d{2}).(?P<time>\d{0,3})$', date)
+    output = "%Y-%m-%d-%H%M"
+    try:
+        parsed = _fast_date(date)
+    except ValueError:
+        # out of range fields, let dateutil decide
+        parsed = None
+    if parsed:
+        return parsed.strftime(output)
+    loading_date = __loading_date.match(date)
     if loading_date:
         date = F"{loading_date.group('date')} {int(loading_date.group('time')):04}"
-    output = "%Y-%m-%d-%H%M"
-    return parser.parse(date, tzinfos=__tzinfos).strftime(output)
+    from dateutil import parser
+    return parser.parse(date, tzinfos=_tzinfos()).strftime(output)
 
+@functools.lru_cache(maxsize=1<<16)
 def tracknumber_from_date(date: str) -> str:
-    epoch = parser.parse('2000-09-01') # Start of podcast history
-    return str((parser.parse(date) - epoch).days)
+    try:
+        parsed = _fast_date(date)
+    except ValueError:
+        parsed = None
+    if not parsed:
+        from dateutil import parser
+        parsed = parser.parse(date)
+    return str((parsed - EPOCH).days)
 
-def remove_unicode(string: str) -> str :
+__ok_unicode_map = { ord(i):None for i in __ok_unicode }
+# drops the whitespace before a comma or a space, the same as replacing r'\s*(?P<chr>[ ,])' with its chr but only matching where that changes something
+__whitespace = re.compile(r'\s+(?=[ ,])')
+
+@functools.lru_cache(maxsize=1<<16)
+def _remove_unicode(string: str) -> tuple:
+    """
+    Cleaned string and the reason it could not be cleaned, memoised as the same authors and albums come round on every item
+    """
     clean = string.translate(__unicode_map)
     clean = squelch_whitespace(clean)
 
     #check that the character cleanup worked
     try :
-        clean.translate({ ord(i):None for i in __ok_unicode }).encode('ascii', 'strict')
+        clean.translate(__ok_unicode_map).encode('ascii', 'strict')
     except UnicodeEncodeError as e:
-        logging.warning(F"Failed to remove character from {string}: {e}")
-        return None
+        return None, e
 
+    return clean, None
+
+def remove_unicode(string: str, log=logging) -> str :
+    clean, error = _remove_unicode(string)
+    if error:
+        log.warning(F"Failed to remove character from {string}: {error}")
     return clean
 
-def clean_title(string: str) -> str:
-    clean = remove_unicode(string)
+def clean_title(string: str, log=logging) -> str:
+    clean = remove_unicode(string, log)
     if not clean :
         return None
-    clean = re.sub(r' - ', r': ', clean)
+    clean = clean.replace(' - ', ': ')
     clean = squelch_whitespace(clean)
 
     return clean
 
+@functools.lru_cache(maxsize=1<<16)
 def sanitise_path(string: str) -> str:
     clean = remove_unicode(string).translate(__valid_path_map)
     clean = squelch_whitespace(clean)
@@ -109,8 +212,82 @@ def sanitise_path(string: str) -> str:
     return clean
 
 def squelch_whitespace(string: str) -> str:
-    return re.sub(r'\s*(?P<chr>[ ,])', r'\g<chr>', string)
+    return __whitespace.sub('', string)
+
+
+COPY_CHUNK: int = 8 * 1024 * 1024
+
+def place_file(source: Path, target: Path):
+    """
+    Move source to target without ever replacing an existing target, renaming in place when both are on the same device
+    """
+    if source.stat().st_dev == target.parent.stat().st_dev:
+        try:
+            os.link(source, target)
+            source.unlink()
+            return
+        except FileExistsError:
+            raise
+        except OSError:
+            # filesystem without hard links
+            if target.exists():
+                raise FileExistsError(F"{target} already exists")
+            source.replace(target)
+            return
+    copy_file(source, target)
+    source.unlink()
+
+def copy_file(source: Path, target: Path):
+    """
+    Copy source to a new target file, sharing its blocks on filesystems that can reflink, otherwise in chunks letting the kernel move the data where it can
+    """
+    with source.open(mode='rb') as input, target.open(mode='xb') as output:
+        try:
+            if not _clone_descriptor(input.fileno(), output.fileno()):
+                _copy_descriptor(input.fileno(), output.fileno(), os.fstat(input.fileno()).st_size)
+        except:
+            output.close()
+            target.unlink()
+            raise
+
+FICLONE: int = 0x40049409
+
+def _clone_descriptor(input: int, output: int) -> bool:
+    try:
+        import fcntl
+        fcntl.ioctl(output, FICLONE, input)
+        return True
+    except (ImportError, OSError):
+        return False
 
+def _copy_descriptor(input: int, output: int, size: int):
+    copied = 0
+    if hasattr(os, 'copy_file_range'):
+        try:
+            while copied < size:
+                sent = os.copy_file_range(input, output, min(COPY_CHUNK, size - copied))
+                if not sent:
+                    break
+                copied += sent
+            if copied >= size:
+                return
+        except OSError:
+            pass
+    if hasattr(os, 'sendfile'):
+        try:
+            while copied < size:
+                sent = os.sendfile(output, input, copied, min(COPY_CHUNK, size - copied))
+                if not sent:
+                    break
+                copied += sent
+            if copied >= size:
+                return
+        except OSError:
+            pass
+    os.lseek(input, copied, os.SEEK_SET)
+    os.lseek(output, copied, os.SEEK_SET)
+    with open(input, 'rb', closefd=False) as reader, open(output, 'wb', closefd=False) as writer:
+        shutil.copyfileobj(reader, writer, COPY_CHUNK)
 
 class GenericBisect:
     """